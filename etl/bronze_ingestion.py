@@ -3,18 +3,24 @@ Orquestador de ingesta Bronze Layer
 Coordina descarga M2M, parsing MTL e inserción en PostGIS Raster
 """
 
+import csv
+import io
+import os
+import re
 import shutil
 import subprocess
+import tempfile
 import logging
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
 from datetime import datetime
 
-import psycopg2
-from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
 
-from .m2m_client import M2MClient
 from .mtl_parser import MTLParser
 from .utils import (
     load_config,
@@ -26,6 +32,39 @@ from .utils import (
     get_sensor_from_entity_id
 )
 
+if TYPE_CHECKING:
+    # El cliente M2M (requests, urllib3...) se importa al usarse, no al importar este módulo
+    from .m2m_client import M2MClient
+
+
+# Sufijo de banda en nombres Collection 2 (ej: ..._SR_B3.TIF, ..._QA_PIXEL.TIF)
+_BAND_RE = re.compile(r'_(SR|ST|QA)_([A-Z0-9]+)\.', re.IGNORECASE)
+_MTL_RE = re.compile(r'MTL', re.IGNORECASE)
+
+
+class _CopyDataReader:
+    """
+    Expone como archivo el bloque de datos de un COPY emitido por raster2pgsql -Y,
+    leyendo del stream hasta la línea de fin de datos (\\.)
+    """
+    
+    def __init__(self, stream):
+        self._stream = stream
+        self._done = False
+    
+    def read(self, size: int = -1) -> bytes:
+        if self._done:
+            return b''
+        
+        line = self._stream.readline()
+        if not line or line.rstrip(b'\r\n') == b'\\.':
+            self._done = True
+            return b''
+        
+        return line
+    
+    readline = read
+
 
 class BronzeIngestion:
     """
@@ -66,6 +105,14 @@ class BronzeIngestion:
         self.config = load_config()
         
         self.max_cloud_cover = max_cloud_cover or int(self.env.get('MAX_CLOUD_COVER', 40))
+        self.max_concurrent_downloads = int(self.env.get(
+            'MAX_CONCURRENT_DOWNLOADS',
+            self.config.get('download', {}).get('max_concurrent', 8)
+        ))
+        # Escenas procesadas en paralelo dentro de cada dataset
+        self.scene_workers = max(1, int(self.env.get('SCENE_WORKERS', 4)))
+        # Bandas requeridas por sensor, derivadas de la config una sola vez
+        self._required_bands_by_sensor = self._build_required_bands()
         
         self.logger = logger or setup_logger(
             'BronzeIngestion',
@@ -74,8 +121,23 @@ class BronzeIngestion:
         )
         
         self.temp_dir = self._get_temp_dir()
+        self.spatial_filter = geojson_to_m2m_spatial_filter(load_aoi_geojson())
         self.db_conn_str = get_db_connection_string(self.env)
         
+        # Pool de conexiones a PostgreSQL, creado en el primer uso (nunca en dry-run).
+        # getconn() no espera si el pool está agotado: cada worker de escena retiene una
+        # conexión durante raster2pgsql y el volcado del log necesita otra más
+        self.db_pool_max = max(int(self.env.get('DB_POOL_MAX', 10)), self.scene_workers + 1)
+        self._db_pool: Optional[ThreadedConnectionPool] = None
+        self._db_pool_lock = threading.Lock()
+        
+        # Filas pendientes de bronze.download_log, se cargan con COPY por escena
+        self._log_buffer: List[Tuple] = []
+        self._log_buffer_lock = threading.Lock()
+        
+        # Borrado de directorios de escena en segundo plano (activo durante run())
+        self._cleanup_executor: Optional[ThreadPoolExecutor] = None
+        
         self._check_dependencies()
     
     def _get_temp_dir(self) -> Path:
@@ -100,11 +162,61 @@ class BronzeIngestion:
         if not shutil.which('raster2pgsql'):
             raise RuntimeError("raster2pgsql not found. Install PostGIS tools.")
         
-        if not shutil.which('psql'):
-            raise RuntimeError("psql not found. Install PostgreSQL client.")
-        
         self.logger.info("Dependencies check passed")
     
+    @contextmanager
+    def _db_connection(self):
+        """
+        Presta una conexión del pool durante el bloque
+        
+        Hace commit si el bloque termina sin errores y rollback si lanza una excepción,
+        de modo que la conexión siempre vuelve limpia al pool.
+        
+        Yields:
+            psycopg2.extensions.connection: Conexión a PostgreSQL
+        """
+        with self._db_pool_lock:
+            if self._db_pool is None:
+                self._db_pool = ThreadedConnectionPool(
+                    minconn=1,
+                    maxconn=self.db_pool_max,
+                    dsn=self.db_conn_str
+                )
+            pool = self._db_pool
+        
+        conn = pool.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            pool.putconn(conn, close=bool(conn.closed))
+    
+    @contextmanager
+    def _scene_cursor(self):
+        """
+        Cursor para la transacción de una escena (None en dry-run, sin tocar la BD)
+        
+        Yields:
+            Optional[psycopg2.extensions.cursor]: Cursor de una conexión del pool
+        """
+        if self.dry_run:
+            yield None
+            return
+        
+        with self._db_connection() as conn, conn.cursor() as cursor:
+            yield cursor
+    
+    def close(self):
+        """Cierra todas las conexiones del pool de base de datos"""
+        with self._db_pool_lock:
+            if self._db_pool is not None:
+                self._db_pool.closeall()
+                self._db_pool = None
+    
     def run(self, datasets: Optional[List[str]] = None) -> Dict:
         """
         Ejecuta el pipeline completo de ingesta
@@ -134,9 +246,6 @@ class BronzeIngestion:
         self.logger.info(f"Starting ingestion from {self.start_date} to {self.end_date}")
         self.logger.info(f"Datasets: {datasets}")
         
-        aoi_geojson = load_aoi_geojson()
-        spatial_filter = geojson_to_m2m_spatial_filter(aoi_geojson)
-        
         temporal_filter = {
             'start': self.start_date,
             'end': self.end_date
@@ -147,41 +256,96 @@ class BronzeIngestion:
             'max': self.max_cloud_cover
         }
         
-        with M2MClient(logger=self.logger, dry_run=self.dry_run) as client:
-            for dataset_name in datasets:
+        from .m2m_client import M2MClient
+        
+        self._cleanup_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='scene-cleanup')
+        
+        try:
+            # Una conexión por rango simultáneo: escenas en paralelo x bandas por escena x rangos por banda
+            with M2MClient(
+                logger=self.logger,
+                dry_run=self.dry_run,
+                pool_size=self.scene_workers * self.max_concurrent_downloads * M2MClient.RANGE_DOWNLOAD_PARTS
+            ) as client:
+                # Buscar primero en todos los datasets (en paralelo) para consultar la BD una sola vez
+                entity_ids_by_dataset: Dict[str, List[str]] = {}
+                
+                with ThreadPoolExecutor(max_workers=max(1, len(datasets))) as executor:
+                    search_futures = {
+                        dataset_name: executor.submit(
+                            self._search_dataset,
+                            client,
+                            dataset_name,
+                            self.spatial_filter,
+                            temporal_filter,
+                            cloud_filter
+                        )
+                        for dataset_name in datasets
+                    }
+                
+                # Resultados en el orden de datasets, para procesarlos de forma determinista
+                for dataset_name, future in search_futures.items():
+                    try:
+                        entity_ids_by_dataset[dataset_name] = future.result()
+                    except Exception as e:
+                        error_msg = f"Error processing dataset {dataset_name}: {e}"
+                        self.logger.error(error_msg)
+                        stats['errors'].append(error_msg)
+                
                 try:
-                    dataset_stats = self._process_dataset(
-                        client,
-                        dataset_name,
-                        spatial_filter,
-                        temporal_filter,
-                        cloud_filter
-                    )
-                    
-                    stats['total_scenes'] += dataset_stats['total_scenes']
-                    stats['total_bands'] += dataset_stats['total_bands']
-                    stats['successful_scenes'] += dataset_stats['successful_scenes']
-                    stats['failed_scenes'] += dataset_stats['failed_scenes']
-                    stats['errors'].extend(dataset_stats['errors'])
-                    
+                    existing_ids = self._get_existing_entity_ids([
+                        entity_id
+                        for entity_ids in entity_ids_by_dataset.values()
+                        for entity_id in entity_ids
+                    ])
                 except Exception as e:
-                    error_msg = f"Error processing dataset {dataset_name}: {e}"
+                    error_msg = f"Error checking existing scenes: {e}"
                     self.logger.error(error_msg)
                     stats['errors'].append(error_msg)
+                    entity_ids_by_dataset = {}
+                
+                for dataset_name, entity_ids in entity_ids_by_dataset.items():
+                    try:
+                        dataset_stats = self._process_dataset(
+                            client,
+                            dataset_name,
+                            entity_ids,
+                            existing_ids
+                        )
+                        
+                        stats['total_scenes'] += dataset_stats['total_scenes']
+                        stats['total_bands'] += dataset_stats['total_bands']
+                        stats['successful_scenes'] += dataset_stats['successful_scenes']
+                        stats['failed_scenes'] += dataset_stats['failed_scenes']
+                        stats['errors'].extend(dataset_stats['errors'])
+                        
+                    except Exception as e:
+                        error_msg = f"Error processing dataset {dataset_name}: {e}"
+                        self.logger.error(error_msg)
+                        stats['errors'].append(error_msg)
+        finally:
+            try:
+                self._flush_log_buffer()
+            except Exception as e:
+                self.logger.error(f"Failed to flush download log: {e}")
+            self.close()
+            # Esperar a que terminen los borrados pendientes antes de retornar
+            self._cleanup_executor.shutdown(wait=True)
+            self._cleanup_executor = None
         
         self.logger.info(f"Ingestion completed: {stats}")
         return stats
     
-    def _process_dataset(
+    def _search_dataset(
         self,
-        client: M2MClient,
+        client: 'M2MClient',
         dataset_name: str,
         spatial_filter: Dict,
         temporal_filter: Dict,
         cloud_filter: Dict
-    ) -> Dict:
+    ) -> List[str]:
         """
-        Procesa un dataset específico
+        Busca las escenas de un dataset que cumplen los filtros
         
         Args:
             client: Cliente M2M autenticado
@@ -191,16 +355,8 @@ class BronzeIngestion:
             cloud_filter: Filtro de nubes
         
         Returns:
-            Dict: Estadísticas del dataset
+            List[str]: Entity IDs encontrados
         """
-        stats = {
-            'total_scenes': 0,
-            'total_bands': 0,
-            'successful_scenes': 0,
-            'failed_scenes': 0,
-            'errors': []
-        }
-        
         self.logger.info(f"Searching scenes in {dataset_name}")
         
         scenes = client.search_scenes(
@@ -211,21 +367,47 @@ class BronzeIngestion:
             max_results=1000
         )
         
-        if not scenes:
+        return [scene['entityId'] for scene in scenes or []]
+    
+    def _process_dataset(
+        self,
+        client: 'M2MClient',
+        dataset_name: str,
+        entity_ids: List[str],
+        existing_ids: Set[str]
+    ) -> Dict:
+        """
+        Procesa un dataset específico
+        
+        Args:
+            client: Cliente M2M autenticado
+            dataset_name: Nombre del dataset M2M
+            entity_ids: Entity IDs encontrados en la búsqueda
+            existing_ids: Entity IDs ya registrados en la BD (todos los datasets)
+        
+        Returns:
+            Dict: Estadísticas del dataset
+        """
+        stats = {
+            'total_scenes': 0,
+            'total_bands': 0,
+            'successful_scenes': 0,
+            'failed_scenes': 0,
+            'errors': []
+        }
+        
+        if not entity_ids:
             self.logger.warning(f"No scenes found in {dataset_name}")
             return stats
         
-        stats['total_scenes'] = len(scenes)
-        entity_ids = [scene['entityId'] for scene in scenes]
-        
-        existing_ids = self._get_existing_entity_ids(entity_ids)
+        stats['total_scenes'] = len(entity_ids)
         new_entity_ids = [eid for eid in entity_ids if eid not in existing_ids]
         
         if not new_entity_ids:
             self.logger.info(f"All {len(entity_ids)} scenes already in database")
             return stats
         
-        self.logger.info(f"Processing {len(new_entity_ids)} new scenes (skipping {len(existing_ids)} existing)")
+        self.logger.info(f"Processing {len(new_entity_ids)} new scenes (skipping {len(entity_ids) - len(new_entity_ids)} existing)")
         
         list_id = f"temp_{dataset_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         client.add_scenes_to_list(list_id, new_entity_ids, dataset_name)
@@ -233,19 +415,28 @@ class BronzeIngestion:
         products = client.get_download_options(list_id, dataset_name, file_type='band')
         
         try: # Ensure list cleanup even if scene processing fails
-            for entity_id in new_entity_ids:
-                try:
-                    scene_stats = self._process_scene(client, entity_id, products, dataset_name)
-                    stats['total_bands'] += scene_stats['bands_processed']
-                    stats['successful_scenes'] += 1
-                    
-                except Exception as e:
-                    error_msg = f"Failed to process scene {entity_id}: {e}"
-                    self.logger.error(error_msg)
-                    stats['failed_scenes'] += 1
-                    stats['errors'].append(error_msg)
-                    # Call _log_download_failure with appropriate placeholders for a scene-level error
-                    self._log_download_failure(entity_id, "SCENE_PROCESSING_ERROR", "N/A", None, str(e))
+            workers = min(self.scene_workers, len(new_entity_ids))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(self._process_scene, client, entity_id, products, dataset_name): entity_id
+                    for entity_id in new_entity_ids
+                }
+                
+                # Las estadísticas se agregan solo en este hilo, a medida que terminan las escenas
+                for future in as_completed(futures):
+                    entity_id = futures[future]
+                    try:
+                        scene_stats = future.result()
+                        stats['total_bands'] += scene_stats['bands_processed']
+                        stats['successful_scenes'] += 1
+                        
+                    except Exception as e:
+                        error_msg = f"Failed to process scene {entity_id}: {e}"
+                        self.logger.error(error_msg)
+                        stats['failed_scenes'] += 1
+                        stats['errors'].append(error_msg)
+                        # Call _log_download_failure with appropriate placeholders for a scene-level error
+                        self._log_download_failure(entity_id, "SCENE_PROCESSING_ERROR", "N/A", None, str(e))
         finally:
             # Clean up the M2M list
             if self.dry_run:
@@ -261,7 +452,7 @@ class BronzeIngestion:
     
     def _process_scene(
         self,
-        client: M2MClient,
+        client: 'M2MClient',
         entity_id: str,
         products: List[Dict],
         dataset_name: str
@@ -289,25 +480,32 @@ class BronzeIngestion:
         if not downloads:
             raise ValueError(f"No bands available for {entity_id}")
         
-        download_results = client.request_downloads(downloads, label=entity_id)
-        
-        available = download_results.get('availableDownloads', [])
+        download_request = client.request_downloads(downloads, label=entity_id)
+        available = (download_request or {}).get('availableDownloads')
         
         if not available:
             raise ValueError(f"No downloads available for {entity_id}")
         
+        # download_files_parallel crea el directorio de la escena una sola vez
         scene_dir = self.temp_dir / entity_id
-        scene_dir.mkdir(parents=True, exist_ok=True)
-        
         
-        download_urls = [{'url': item['url'], 'entityId': entity_id} for item in available]
+        # Nombre de archivo conocido (displayId de download-options) para no deducirlo de los headers
+        display_ids = {dl['productId']: dl.get('displayId') for dl in downloads}
+        download_urls = [
+            {
+                'url': item['url'],
+                'entityId': entity_id,
+                'filename': item.get('displayId') or display_ids.get(item.get('productId'))
+            }
+            for item in available
+        ]
         
         # results: List[Tuple[str, bool, Optional[Path], Optional[str], str, Optional[float]]]
         # (entity_id_dl, success_dl, filepath_dl, error_dl, url_dl, duration_dl)
         download_results = client.download_files_parallel(
             download_urls,
             scene_dir,
-            max_workers=int(self.env.get('MAX_CONCURRENT_DOWNLOADS', 5))
+            max_workers=self.max_concurrent_downloads
         )
         
         successfully_downloaded_tifs: List[Tuple[Path, str]] = []
@@ -326,6 +524,9 @@ class BronzeIngestion:
                 log_band_name = band_name_dl if band_name_dl else "UNKNOWN_BAND"
                 log_error_msg = error_dl if error_dl else "Unknown download error"
                 self._log_download_failure(entity_id_dl, log_band_name, url_dl, duration_dl, log_error_msg)
+        
+        # Un único COPY por escena con el resultado de todas sus bandas
+        self._flush_log_buffer()
 
         if not successfully_downloaded_tifs:
             raise ValueError(f"No TIF files were successfully downloaded for {entity_id}. Cannot proceed with ingestion.")
@@ -335,16 +536,50 @@ class BronzeIngestion:
         if not mtl_file:
             raise ValueError(f"MTL file not found for {entity_id}")
         
-        scene_id = self._insert_scene_metadata(mtl_file, dataset_name)
-        
-        bands_ingested = self._ingest_bands_to_postgis(successfully_downloaded_tifs, scene_id, entity_id)
+        # Metadatos y bandas en una sola transacción: si la carga de bandas falla, la escena
+        # no queda registrada en bronze.landsat_scenes y una reejecución la vuelve a procesar
+        with self._scene_cursor() as cursor:
+            scene_id, acquisition_year = self._insert_scene_metadata(mtl_file, dataset_name, cursor)
+            
+            bands_ingested = self._ingest_bands_to_postgis(successfully_downloaded_tifs, scene_id, acquisition_year, entity_id, cursor)
         
-        shutil.rmtree(scene_dir, ignore_errors=True)
+        self._cleanup_scene_dir(scene_dir)
         
         self.logger.info(f"Scene {entity_id} processed successfully: {bands_ingested} bands ingested")
         
         return {'bands_processed': bands_ingested}
     
+    def _build_required_bands(self) -> Dict[str, Tuple[str, ...]]:
+        """
+        Construye la tabla sensor -> bandas requeridas desde la config,
+        a partir de get_required_bands_for_sensor del cliente M2M
+        
+        Returns:
+            Dict[str, Tuple[str, ...]]: Bandas requeridas por sensor
+        """
+        # Misma tabla sensor -> dataset/bandas que usa el cliente M2M
+        from .m2m_client import _SENSOR_TO_DATASET, get_required_bands_for_sensor
+        
+        required_by_sensor = {}
+        
+        for sensor in _SENSOR_TO_DATASET:
+            bands = get_required_bands_for_sensor(sensor, self.config)
+            required_by_sensor[sensor] = tuple(b for b in bands if b)
+        
+        return required_by_sensor
+    
+    def _cleanup_scene_dir(self, scene_dir: Path):
+        """
+        Elimina el directorio de una escena ya ingestada, en segundo plano si es posible
+        
+        Args:
+            scene_dir: Directorio de la escena
+        """
+        if self._cleanup_executor is None:
+            shutil.rmtree(scene_dir, ignore_errors=True)
+        else:
+            self._cleanup_executor.submit(shutil.rmtree, scene_dir, ignore_errors=True)
+    
     def _get_required_bands(self, sensor: str) -> List[str]:
         """
         Obtiene las bandas requeridas para un sensor
@@ -355,28 +590,8 @@ class BronzeIngestion:
         Returns:
             List[str]: Lista de nombres de bandas
         """
-        sensor_to_dataset = {
-            'OLI': 'landsat_8_9',
-            'ETM+': 'landsat_7',
-            'TM': 'landsat_4_5'
-        }
-        
-        dataset_key = sensor_to_dataset.get(sensor, 'landsat_8_9')
-        dataset_config = self.config['datasets'][dataset_key]
-        bands = dataset_config['bands']
-        
-        required = [
-            bands.get('green'),
-            bands.get('swir1'),
-            bands.get('qa_pixel'),
-            bands.get('qa_radsat'),
-            bands.get('metadata')
-        ]
-        
-        if bands.get('qa_aerosol'):
-            required.append(bands['qa_aerosol'])
-        
-        return [b for b in required if b]
+        # Sensores desconocidos usan las bandas de Landsat 8-9
+        return list(self._required_bands_by_sensor.get(sensor, self._required_bands_by_sensor['OLI']))
     
     def _find_mtl_file(self, scene_dir: Path, entity_id: str) -> Optional[Path]: # Added entity_id
         """
@@ -394,22 +609,34 @@ class BronzeIngestion:
             self.logger.info(f"DRY-RUN: Simulating finding MTL file for {entity_id}. Would use dummy path: {dummy_mtl_path}")
             return dummy_mtl_path
 
-        for pattern in ['*MTL.txt', '*MTL.xml', '*_MTL*']:
-            files = list(scene_dir.glob(pattern))
-            if files:
-                return files[0]
-        return None
+        # Una sola lectura del directorio; se prefiere MTL.txt, luego MTL.xml, luego cualquier *_MTL*
+        fallback: Optional[Path] = None
+        xml_file: Optional[Path] = None
+        
+        with os.scandir(scene_dir) as entries:
+            for entry in entries:
+                # Comparar en mayúsculas: acepta _MTL.TXT, _mtl.txt, etc.
+                name = entry.name.upper()
+                if name.endswith('MTL.TXT'):
+                    return Path(entry.path)
+                if xml_file is None and name.endswith('MTL.XML'):
+                    xml_file = Path(entry.path)
+                elif fallback is None and '_MTL' in name:
+                    fallback = Path(entry.path)
+        
+        return xml_file or fallback
     
-    def _insert_scene_metadata(self, mtl_file: Path, dataset_name: str) -> int:
+    def _insert_scene_metadata(self, mtl_file: Path, dataset_name: str, cursor) -> Tuple[int, int]:
         """
         Parsea el MTL e inserta metadatos en bronze.landsat_scenes
         
         Args:
             mtl_file: Ruta al archivo MTL
             dataset_name: Nombre del dataset M2M
+            cursor: Cursor de la transacción de la escena (el commit lo hace el llamador)
         
         Returns:
-            int: scene_id de la escena insertada
+            Tuple[int, int]: (scene_id, año de adquisición) de la escena insertada
         """
         parser = MTLParser(mtl_file, dry_run=self.dry_run) # Pass dry_run flag
         metadata = parser.get_scene_metadata()
@@ -419,51 +646,43 @@ class BronzeIngestion:
         if self.dry_run:
             self.logger.info(f"DRY-RUN: Would insert scene metadata for {metadata['entity_id']}.")
             self.logger.debug(f"DRY-RUN: Scene metadata: {metadata}")
-            return 0 # Return a dummy scene_id for dry-run
+            return 0, datetime.now().year # Dummy scene_id/year for dry-run
+        
+        sql = """
+            INSERT INTO bronze.landsat_scenes (
+                entity_id, display_id, dataset_name, sensor, satellite,
+                acquisition_date, path_row, cloud_cover, sun_azimuth, sun_elevation,
+                processing_level, footprint
+            ) VALUES (
+                %(entity_id)s, %(display_id)s, %(dataset_name)s, %(sensor)s, %(satellite)s,
+                %(acquisition_date)s, %(path_row)s, %(cloud_cover)s, %(sun_azimuth)s,
+                %(sun_elevation)s, %(processing_level)s, 
+                ST_Transform(ST_GeomFromText(%(footprint_wkt)s, 4326), 32619)
+            )
+            ON CONFLICT (entity_id) DO UPDATE SET
+                cloud_cover = EXCLUDED.cloud_cover,
+                sun_azimuth = EXCLUDED.sun_azimuth,
+                sun_elevation = EXCLUDED.sun_elevation
+            RETURNING scene_id, EXTRACT(YEAR FROM acquisition_date)::int
+        """
         
-        conn = psycopg2.connect(self.db_conn_str)
-        cursor = conn.cursor()
+        cursor.execute(sql, metadata)
+        scene_id, acquisition_year = cursor.fetchone()
         
-        try:
-            sql = """
-                INSERT INTO bronze.landsat_scenes (
-                    entity_id, display_id, dataset_name, sensor, satellite,
-                    acquisition_date, path_row, cloud_cover, sun_azimuth, sun_elevation,
-                    processing_level, footprint
-                ) VALUES (
-                    %(entity_id)s, %(display_id)s, %(dataset_name)s, %(sensor)s, %(satellite)s,
-                    %(acquisition_date)s, %(path_row)s, %(cloud_cover)s, %(sun_azimuth)s,
-                    %(sun_elevation)s, %(processing_level)s, 
-                    ST_Transform(ST_GeomFromText(%(footprint_wkt)s, 4326), 32619)
-                )
-                ON CONFLICT (entity_id) DO UPDATE SET
-                    cloud_cover = EXCLUDED.cloud_cover,
-                    sun_azimuth = EXCLUDED.sun_azimuth,
-                    sun_elevation = EXCLUDED.sun_elevation
-                RETURNING scene_id
-            """
-            
-            cursor.execute(sql, metadata)
-            scene_id = cursor.fetchone()[0]
-            
-            conn.commit()
-            
-            self.logger.info(f"Inserted scene metadata: {metadata['entity_id']} (scene_id={scene_id})")
-            
-            return scene_id
-            
-        finally:
-            cursor.close()
-            conn.close()
+        self.logger.info(f"Inserted scene metadata: {metadata['entity_id']} (scene_id={scene_id})")
+        
+        return scene_id, acquisition_year
     
-    def _ingest_bands_to_postgis(self, successfully_downloaded_tifs: List[Tuple[Path, str]], scene_id: int, entity_id: str) -> int:
+    def _ingest_bands_to_postgis(self, successfully_downloaded_tifs: List[Tuple[Path, str]], scene_id: int, acquisition_year: int, entity_id: str, cursor) -> int:
         """
         Ingesta bandas raster usando raster2pgsql
         
         Args:
             successfully_downloaded_tifs: Lista de tuplas (Path al TIF, nombre de la banda)
             scene_id: ID de la escena en bronze.landsat_scenes
+            acquisition_year: Año de adquisición (define la tabla destino)
             entity_id: Entity ID de la escena
+            cursor: Cursor de la transacción de la escena
         
         Returns:
             int: Número de bandas procesadas
@@ -476,56 +695,18 @@ class BronzeIngestion:
             self.logger.info(f"DRY-RUN: Skipping PostGIS ingestion for {len(successfully_downloaded_tifs)} bands from scene {entity_id}")
             return len(successfully_downloaded_tifs) # Simulate success
         
-        acquisition_year = self._get_scene_year(scene_id)
-        
-        bands_processed = 0
-        
-        for tif_file, band_name in successfully_downloaded_tifs:
-            # Skip metadata files ingestion into raster table
-            if tif_file.suffix.lower() in ['.txt', '.xml'] or band_name == 'MTL':
-                continue
-
-            try:
-                self._ingest_single_band(
-                    tif_file,
-                    scene_id,
-                    band_name,
-                    acquisition_year,
-                    entity_id
-                )
-                
-                bands_processed += 1
-                
-            except Exception as e:
-                error_msg = f"Failed to ingest band {tif_file.name}: {e}"
-                self.logger.error(error_msg)
-                # Note: Download logging for this band already occurred in _process_scene.
-                # This error is specifically for ingestion into PostGIS.
+        # Los archivos de metadatos no se cargan en la tabla raster
+        band_files = [
+            (tif_file, band_name) for tif_file, band_name in successfully_downloaded_tifs
+            if tif_file.suffix.lower() not in ['.txt', '.xml'] and band_name != 'MTL'
+        ]
         
-        return bands_processed
-    
-    def _get_scene_year(self, scene_id: int) -> int:
-        """Obtiene el año de adquisición de una escena"""
-        if self.dry_run:
-            self.logger.info(f"DRY-RUN: Simulating scene year retrieval for scene_id {scene_id}")
-            # Retornar un año por defecto para dry_run si scene_id no es 0
-            if scene_id != 0:
-                return datetime.now().year
-            else:
-                return 2026 # For dry-run test
+        if not band_files:
+            return 0
         
-        conn = psycopg2.connect(self.db_conn_str)
-        cursor = conn.cursor()
+        self._ingest_scene_bands(band_files, scene_id, acquisition_year, entity_id, cursor)
         
-        try:
-            cursor.execute(
-                "SELECT EXTRACT(YEAR FROM acquisition_date)::int FROM bronze.landsat_scenes WHERE scene_id = %s",
-                (scene_id,)
-            )
-            return cursor.fetchone()[0]
-        finally:
-            cursor.close()
-            conn.close()
+        return len(band_files)
     
     def _extract_band_name(self, filename: str) -> Optional[str]:
         """
@@ -537,207 +718,196 @@ class BronzeIngestion:
         Returns:
             Optional[str]: Nombre de la banda o None
         """
-        parts = filename.split('_')
-        
-        for i, part in enumerate(parts):
-            if part in ['SR', 'ST', 'QA']:
-                if i + 1 < len(parts):
-                    band = f"{part}_{parts[i+1].split('.')[0]}"
-                    return band
+        match = _BAND_RE.search(filename)
+        if match:
+            return f"{match.group(1)}_{match.group(2)}"
         
-        if 'MTL' in filename.upper():
+        if _MTL_RE.search(filename):
             return 'MTL'
         
         return None
     
-    def _ingest_single_band(
+    def _ingest_scene_bands(
         self,
-        tif_file: Path,
+        band_files: List[Tuple[Path, str]],
         scene_id: int,
-        band_name: str,
         year: int,
-        entity_id: str
+        entity_id: str,
+        cursor
     ):
         """
-        Ingesta una banda usando raster2pgsql | psql
+        Ingesta todas las bandas de una escena con una sola invocación de raster2pgsql
         
         Args:
-            tif_file: Archivo TIF
+            band_files: Lista de tuplas (Path al TIF, nombre de la banda)
             scene_id: ID de la escena
-            band_name: Nombre de la banda
             year: Año de adquisición
             entity_id: Entity ID
+            cursor: Cursor de la transacción de la escena
         """
         target_table = f"bronze.landsat_bands_{year}"
         temp_table = f"bronze.temp_ingest_{uuid.uuid4().hex}"
         
         if self.dry_run:
-            self.logger.info(f"DRY-RUN: Would ingest band '{band_name}' for scene {entity_id} (file: {tif_file.name}) into {target_table}.")
-            self.logger.debug(f"DRY-RUN: raster2pgsql command would be: raster2pgsql -d -t 512x512 -s 32618 -F {tif_file} {temp_table}")
-            self.logger.debug(f"DRY-RUN: SQL INSERT/UPDATE would be: INSERT INTO {target_table} ...; UPDATE {target_table} ...")
+            self.logger.info(f"DRY-RUN: Would ingest {len(band_files)} bands for scene {entity_id} into {target_table}.")
+            self.logger.debug(f"DRY-RUN: raster2pgsql command would be: raster2pgsql -d -t 512x512 -F <{len(band_files)} files> {temp_table}")
+            self.logger.debug(f"DRY-RUN: SQL INSERT would be: INSERT INTO {target_table} ... SELECT ... FROM {temp_table}")
             return
 
-        # Usamos -d para DROP/CREATE de la tabla temporal
-        # -Y conserva COPY statement en lugar de INSERT, mas rapido
+        # Usamos -d para DROP/CREATE de la tabla temporal; todas las bandas van a la misma tabla
+        # -F agrega la columna filename, que luego se usa para asignar el nombre de banda
+        # -Y emite COPY en lugar de INSERT, que se envía con copy_expert por la conexión del pool
         # Eliminado -s 32618 para permitir autodetección del SRID del GeoTIFF
         raster2pgsql_cmd = [
             'raster2pgsql',
             '-d',  # Drop and recreate (create mode)
+            '-Y',
             '-t', '512x512',
             '-F',
-            str(tif_file),
+            *[str(tif_file) for tif_file, _ in band_files],
             temp_table
         ]
         
-        psql_cmd = [
-            'psql',
-            self.db_conn_str
-        ]
+        self.logger.debug(f"Ingesting {len(band_files)} bands for {entity_id} via {temp_table}")
         
-        self.logger.debug(f"Ingesting {band_name} for {entity_id} via {temp_table}")
+        filenames = [tif_file.name for tif_file, _ in band_files]
+        band_names = [band_name for _, band_name in band_files]
         
-        raster2pgsql_proc = subprocess.Popen(
-            raster2pgsql_cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        
-        psql_proc = subprocess.Popen(
-            psql_cmd,
-            stdin=raster2pgsql_proc.stdout,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        
-        raster2pgsql_proc.stdout.close()
-        
-        stdout, stderr = psql_proc.communicate()
-        
-        # stdout contiene el output de psql, que puede ser verboso si hay mensajes informativos
-        # Lo omitimos para no llenar el log con geometrías si por error se logueara el input
-        # if stdout:
-        #    self.logger.debug(f"psql stdout: {stdout.decode().strip()}")
-        if stderr:
-            stderr_text = stderr.decode().strip()
-            # PostgreSQL envía NOTICES a stderr. Si es un aviso de que la tabla no existe (normal al usar -d), lo logueamos como INFO.
-            if "NOTICE" in stderr_text and "does not exist, skipping" in stderr_text:
-                self.logger.info(f"psql notice: {stderr_text}")
-            else:
-                self.logger.error(f"psql stderr: {stderr_text}")
-        
-        if psql_proc.returncode != 0:
-            raise RuntimeError(f"raster2pgsql | psql failed: {stderr.decode()}")
-        
-        conn = psycopg2.connect(self.db_conn_str)
-        cursor = conn.cursor()
+        # stderr va a un archivo temporal: si fuera un pipe sin leer, una salida de errores
+        # mayor que el buffer bloquearía a raster2pgsql mientras leemos stdout
+        stderr_file = tempfile.TemporaryFile()
+        try:
+            raster2pgsql_proc = subprocess.Popen(
+                raster2pgsql_cmd,
+                stdout=subprocess.PIPE,
+                stderr=stderr_file
+            )
+        except BaseException:
+            stderr_file.close()
+            raise
         
         try:
-            # Insertar en tabla destino desde temporal
+            # Carga, copia a la tabla destino y borrado de la temporal dentro de la transacción
+            # de la escena: si algo falla, el rollback descarta también la tabla temporal
+            statement = b''
+            
+            for line in iter(raster2pgsql_proc.stdout.readline, b''):
+                statement += line
+                if not line.rstrip().endswith(b';'):
+                    continue
+                
+                sql = statement.decode().strip()
+                statement = b''
+                
+                # La transacción la maneja el pool, no raster2pgsql
+                if sql.upper() in ('BEGIN;', 'END;', 'COMMIT;'):
+                    continue
+                
+                if sql.upper().startswith('COPY '):
+                    cursor.copy_expert(sql, _CopyDataReader(raster2pgsql_proc.stdout))
+                else:
+                    cursor.execute(sql)
+            
+            if raster2pgsql_proc.wait() != 0:
+                stderr_file.seek(0)
+                stderr = stderr_file.read().decode(errors='replace').strip()
+                raise RuntimeError(f"raster2pgsql failed: {stderr}")
+            
+            # Insertar todas las bandas en la tabla destino desde la temporal
             cursor.execute(
                 f"""
                 INSERT INTO {target_table} (scene_id, band_name, year, rast, filename)
-                SELECT %s, %s, %s, rast, filename 
-                FROM {temp_table};
+                SELECT %s, b.band_name, %s, t.rast, t.filename
+                FROM {temp_table} t
+                JOIN unnest(%s::text[], %s::text[]) AS b(filename, band_name)
+                    ON b.filename = t.filename;
                 """,
-                (scene_id, band_name, year)
+                (scene_id, year, filenames, band_names)
             )
             
             # Borrar tabla temporal
             cursor.execute(f"DROP TABLE IF EXISTS {temp_table}")
-            
-            conn.commit()
-            
-        except Exception as e:
-            conn.rollback()
-            try:
-                with psycopg2.connect(self.db_conn_str) as clean_conn:
-                    with clean_conn.cursor() as clean_cursor:
-                         clean_cursor.execute(f"DROP TABLE IF EXISTS {temp_table}")
-                         clean_conn.commit()
-            except:
-                pass
-            raise e
-            
         finally:
-            cursor.close()
-            conn.close()
-        
-        
-        
-    def _get_existing_entity_ids(self, entity_ids: List[str]) -> List[str]:
+            if raster2pgsql_proc.poll() is None:
+                raster2pgsql_proc.kill()
+            raster2pgsql_proc.wait()
+            raster2pgsql_proc.stdout.close()
+            stderr_file.close()
+    
+    def _get_existing_entity_ids(self, entity_ids: List[str]) -> Set[str]:
         """Consulta qué entity_ids ya existen en la BD"""
         if not entity_ids:
-            return []
+            return set()
         
         if self.dry_run:
-            self.logger.info("DRY-RUN: Simulating check for existing entity_ids. Returning empty list.")
-            return [] # In dry-run, assume no existing to simulate full ingestion
-        
-        conn = psycopg2.connect(self.db_conn_str)
-        cursor = conn.cursor()
+            self.logger.info("DRY-RUN: Simulating check for existing entity_ids. Returning empty set.")
+            return set() # In dry-run, assume no existing to simulate full ingestion
         
-        try:
+        with self._db_connection() as conn, conn.cursor() as cursor:
             cursor.execute(
                 "SELECT entity_id FROM bronze.landsat_scenes WHERE entity_id = ANY(%s)",
                 (entity_ids,)
             )
-            return [row[0] for row in cursor.fetchall()]
-        finally:
-            cursor.close()
-            conn.close()
+            return {row[0] for row in cursor.fetchall()}
     
     def _log_download_success(self, entity_id: str, band_name: str, tif_file: Path, download_url: str, download_duration_seconds: float):
-        """Registra una descarga exitosa en bronze.download_log"""
+        """Encola una descarga exitosa para bronze.download_log"""
         if self.dry_run:
             simulated_file_size_mb = 100.0 # Use a dummy size for dry-run logging
             self.logger.info(f"DRY-RUN: Would log successful download for {entity_id}/{band_name} (URL: {download_url}, Duration: {download_duration_seconds:.2f}s, Size: {simulated_file_size_mb:.2f}MB)")
             return
 
-        conn = psycopg2.connect(self.db_conn_str)
-        cursor = conn.cursor()
+        file_size_mb = tif_file.stat().st_size / (1024 * 1024)
         
-        try:
-            file_size_mb = tif_file.stat().st_size / (1024 * 1024)
-            
-            cursor.execute(
-                """
-                INSERT INTO bronze.download_log (
-                    entity_id, band_name, download_status, file_size_mb,
-                    download_url, download_duration_seconds
-                ) VALUES (%s, %s, %s, %s, %s, %s)
-                """,
-                (entity_id, band_name, 'success', file_size_mb,
+        with self._log_buffer_lock:
+            self._log_buffer.append(
+                (entity_id, band_name, 'success', file_size_mb, None,
                  download_url, download_duration_seconds)
             )
-            conn.commit()
-        finally:
-            cursor.close()
-            conn.close()
     
     def _log_download_failure(self, entity_id: str, band_name: str, download_url: str, download_duration_seconds: Optional[float], error_message: str):
-        """Registra un fallo de descarga en bronze.download_log"""
+        """Encola un fallo de descarga para bronze.download_log"""
         if self.dry_run:
             self.logger.warning(f"DRY-RUN: Would log FAILED download for {entity_id}/{band_name} (URL: {download_url}, Duration: {download_duration_seconds:.2f}s, Error: {error_message})")
             return
-            
-        conn = psycopg2.connect(self.db_conn_str)
-        cursor = conn.cursor()
         
-        try:
-            cursor.execute(
-                """
-                INSERT INTO bronze.download_log (
-                    entity_id, band_name, download_status, error_message,
-                    download_url, download_duration_seconds
-                ) VALUES (%s, %s, %s, %s, %s, %s)
-                """,
-                (entity_id, band_name, 'failed', error_message,
+        with self._log_buffer_lock:
+            self._log_buffer.append(
+                (entity_id, band_name, 'failed', None, error_message,
                  download_url, download_duration_seconds)
             )
-            conn.commit()
-        finally:
-            cursor.close()
-            conn.close()
+    
+    def _flush_log_buffer(self):
+        """Carga en bronze.download_log todas las filas encoladas con un único COPY"""
+        with self._log_buffer_lock:
+            rows, self._log_buffer = self._log_buffer, []
+        
+        if not rows:
+            return
+        
+        # None se escribe como \N, declarado como marcador NULL en el COPY
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(
+            [r'\N' if value is None else value for value in row] for row in rows
+        )
+        buffer.seek(0)
+        
+        try:
+            with self._db_connection() as conn, conn.cursor() as cursor:
+                cursor.copy_expert(
+                    """
+                    COPY bronze.download_log (
+                        entity_id, band_name, download_status, file_size_mb, error_message,
+                        download_url, download_duration_seconds
+                    ) FROM STDIN WITH (FORMAT csv, NULL '\\N')
+                    """,
+                    buffer
+                )
+        except Exception:
+            # Devolver las filas al buffer para reintentarlas en el siguiente flush
+            with self._log_buffer_lock:
+                self._log_buffer[:0] = rows
+            raise
 
 
 if __name__ == '__main__':
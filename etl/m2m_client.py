@@ -3,9 +3,16 @@ Cliente para USGS Machine-to-Machine (M2M) API
 Maneja autenticación, búsqueda de escenas y descarga de bandas Landsat
 """
 
+import os
+import re
 import sys
+import json
 import time
+import shutil
+import hashlib
 import logging
+import threading
+from functools import lru_cache
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -18,13 +25,81 @@ from urllib3.util.retry import Retry
 from .utils import (
     load_config,
     load_env,
+    get_data_dirs,
     setup_logger,
+    json_dumps,
+    json_loads,
     geojson_to_m2m_spatial_filter,
     format_file_size,
     get_sensor_from_entity_id
 )
 
 
+# Dataset de configuración por sensor y orden de las bandas requeridas
+_SENSOR_TO_DATASET = {
+    'OLI': 'landsat_8_9',
+    'ETM+': 'landsat_7',
+    'TM': 'landsat_4_5'
+}
+_BAND_ORDER = ('green', 'swir1', 'qa_pixel', 'qa_radsat', 'qa_aerosol', 'metadata')
+
+# Nombre de archivo en el header Content-Disposition
+_FILENAME_RE = re.compile(r'filename="?([^"]+)"?')
+
+# Header Content-Range de una respuesta parcial: bytes <inicio>-<fin>/<total>
+_CONTENT_RANGE_RE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+)')
+
+
+@lru_cache(maxsize=16)
+def _compile_band_pattern(band_names: Tuple[str, ...]) -> 're.Pattern':
+    """
+    Compila una única alternancia para buscar cualquiera de las bandas en un displayId
+    
+    Args:
+        band_names: Nombres de bandas (tupla, para poder cachear por sensor)
+    
+    Returns:
+        re.Pattern: Patrón compilado
+    """
+    return re.compile('|'.join(re.escape(band) for band in band_names))
+
+
+@lru_cache(maxsize=4)
+def _get_session(max_retries: int, pool_connections: int, pool_size: int) -> requests.Session:
+    """
+    Crea (una vez por configuración) una sesión de requests con retry automático
+    
+    La sesión no lleva headers de autenticación: el X-Auth-Token se envía por request,
+    por lo que puede compartirse entre instancias de M2MClient.
+    
+    Args:
+        max_retries: Número de reintentos
+        pool_connections: Número de pools de conexión (hosts) a mantener
+        pool_size: Conexiones keep-alive por host
+    
+    Returns:
+        requests.Session: Sesión configurada
+    """
+    session = requests.Session()
+    
+    retry_strategy = Retry(
+        total=max_retries,
+        backoff_factor=1,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["HEAD", "GET", "POST", "OPTIONS"]
+    )
+    
+    adapter = HTTPAdapter(
+        max_retries=retry_strategy,
+        pool_connections=pool_connections,
+        pool_maxsize=pool_size
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    
+    return session
+
+
 class M2MClient:
     """
     Cliente para la API Machine-to-Machine de USGS Earth Explorer
@@ -40,6 +115,30 @@ class M2MClient:
     
     BASE_URL = "https://m2m.cr.usgs.gov/api/api/json/stable/"
     
+    # Pool de conexiones keep-alive compartido por API y descargas paralelas
+    POOL_CONNECTIONS = 16
+    POOL_MAXSIZE = 32
+    
+    # Los API keys de M2M expiran a las 2 horas; se reutilizan algo menos
+    API_KEY_TTL_SECONDS = 7000
+    API_KEY_CACHE_FILE = '.m2m_api_key.json'
+    
+    # Directorio (en data/temp) para el cache de respuestas de scene-search
+    SEARCH_CACHE_DIR = 'm2m_search_cache'
+    
+    # Máximo de entity IDs por llamada a scene-list-add
+    SCENE_LIST_BATCH_SIZE = 500
+    
+    # Archivos mayores a este tamaño se descargan en rangos HTTP concurrentes
+    RANGE_DOWNLOAD_MIN_BYTES = 32 * 1024 * 1024
+    RANGE_DOWNLOAD_PARTS = 4
+    # El GET inicial pide solo este primer rango: los archivos pequeños llegan completos
+    # y en los grandes su cuerpo se lee entero, así la conexión vuelve al pool
+    INITIAL_RANGE_BYTES = RANGE_DOWNLOAD_MIN_BYTES // RANGE_DOWNLOAD_PARTS
+    
+    # Tamaño de bloque para escribir descargas a disco (1 MiB, 4 MiB en Windows)
+    DOWNLOAD_CHUNK_SIZE = 4 * 1024 * 1024 if os.name == 'nt' else 1024 * 1024
+    
     def __init__(
         self,
         username: Optional[str] = None,
@@ -47,7 +146,8 @@ class M2MClient:
         max_retries: int = 3,
         timeout: int = 300,
         logger: Optional[logging.Logger] = None,
-        dry_run: bool = False
+        dry_run: bool = False,
+        pool_size: Optional[int] = None
     ):
         """
         Inicializa el cliente M2M
@@ -59,12 +159,16 @@ class M2MClient:
             timeout: Timeout en segundos para requests
             logger: Logger personalizado (crea uno si es None)
             dry_run: Si es True, simula la ejecución sin realizar descargas reales.
+            pool_size: Conexiones keep-alive por host (por defecto POOL_MAXSIZE); debe cubrir
+                       el máximo de descargas simultáneas por RANGE_DOWNLOAD_PARTS
         """
         # Cargar credenciales
         env = load_env()
         self.username = username or env.get('M2M_USERNAME')
         self.token = token or env.get('M2M_TOKEN')
         self.dry_run = dry_run # Store dry_run flag
+        # Reutilizar el API key entre ejecuciones (M2M_CACHE_API_KEY=true en .env)
+        self.cache_api_key = (env.get('M2M_CACHE_API_KEY') or '').lower() in ('1', 'true', 'yes')
         
         if not self.username or not self.token:
             raise ValueError("M2M credentials not found. Set M2M_USERNAME and M2M_TOKEN in .env")
@@ -73,6 +177,9 @@ class M2MClient:
         self.base_url = self.BASE_URL
         self.timeout = timeout
         self.api_key = None
+        self._api_key_from_cache = False
+        # Serializa la re-autenticación cuando varios hilos ven rechazado el mismo key
+        self._login_lock = threading.Lock()
         
         # Logger
         self.logger = logger or setup_logger(
@@ -82,46 +189,156 @@ class M2MClient:
         )
         
         # Configurar sesión con retry
-        self.session = self._create_session(max_retries)
+        self.session = self._create_session(max_retries, max(pool_size or 0, self.POOL_MAXSIZE))
         
         # Cargar configuración de datasets
         self.config = load_config()
+        
+        # TTL del cache de búsquedas (0 desactiva el cache)
+        self.search_cache_ttl = int(self.config.get('m2m', {}).get('search_cache_ttl_seconds', 0))
     
-    def _create_session(self, max_retries: int) -> requests.Session:
+    def _create_session(self, max_retries: int, pool_size: int = POOL_MAXSIZE) -> requests.Session:
         """
-        Crea una sesión de requests con retry automático
+        Obtiene la sesión de requests con retry automático, compartida entre instancias
+        con la misma configuración para reutilizar sus conexiones keep-alive
         
         Args:
             max_retries: Número de reintentos
+            pool_size: Conexiones keep-alive por host
         
         Returns:
             requests.Session: Sesión configurada
         """
-        session = requests.Session()
+        return _get_session(max_retries, self.POOL_CONNECTIONS, pool_size)
+    
+    def _get_api_key_cache_path(self) -> Path:
+        """Retorna la ruta del archivo donde se cachea el API key"""
+        return get_data_dirs()['temp'] / self.API_KEY_CACHE_FILE
+    
+    def _load_cached_api_key(self) -> Optional[str]:
+        """
+        Lee el API key cacheado en disco si pertenece al usuario actual y no ha expirado
         
-        retry_strategy = Retry(
-            total=max_retries,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["HEAD", "GET", "POST", "OPTIONS"]
-        )
+        Returns:
+            Optional[str]: API key vigente o None
+        """
+        try:
+            with open(self._get_api_key_cache_path(), 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
         
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        session.mount("http://", adapter)
-        session.mount("https://", adapter)
+        if cached.get('username') != self.username:
+            return None
+        
+        # Margen de 60 s para no usar un key que expire a mitad de la ejecución
+        if cached.get('expires_at', 0) <= time.time() + 60:
+            return None
+        
+        return cached.get('api_key')
+    
+    def _store_cached_api_key(self):
+        """Guarda el API key actual en disco (permisos 0600)"""
+        cache_path = self._get_api_key_cache_path()
+        cached = {
+            'username': self.username,
+            'api_key': self.api_key,
+            'expires_at': time.time() + self.API_KEY_TTL_SECONDS
+        }
         
-        return session
+        try:
+            fd = os.open(cache_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(cached, f)
+        except OSError as e:
+            self.logger.warning(f"Could not cache API key: {e}")
+    
+    def _clear_cached_api_key(self):
+        """Elimina el API key cacheado en disco"""
+        try:
+            self._get_api_key_cache_path().unlink()
+        except OSError:
+            pass
     
-    def login(self) -> bool:
+    def _get_search_cache_path(self, payload: Dict) -> Path:
+        """
+        Retorna la ruta del cache para un payload de scene-search
+        
+        Args:
+            payload: Payload de la búsqueda
+        
+        Returns:
+            Path: Archivo de cache, nombrado por el hash canónico del payload
+        """
+        canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+        digest = hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+        return get_data_dirs()['temp'] / self.SEARCH_CACHE_DIR / f"{digest}.json"
+    
+    def _load_cached_search(self, payload: Dict) -> Optional[List[Dict]]:
+        """
+        Lee del cache el resultado de una búsqueda si no ha expirado
+        
+        Args:
+            payload: Payload de la búsqueda
+        
+        Returns:
+            Optional[List[Dict]]: Escenas cacheadas o None
+        """
+        try:
+            with open(self._get_search_cache_path(payload), 'rb') as f:
+                cached = json_loads(f.read())
+        except (OSError, ValueError):
+            return None
+        
+        if cached.get('expires_at', 0) <= time.time():
+            return None
+        
+        return cached.get('scenes')
+    
+    def _store_cached_search(self, payload: Dict, scenes: List[Dict]):
+        """
+        Guarda en cache el resultado de una búsqueda (escritura atómica)
+        
+        Args:
+            payload: Payload de la búsqueda
+            scenes: Escenas retornadas por la API
+        """
+        cache_path = self._get_search_cache_path(payload)
+        part_path = cache_path.with_name(cache_path.name + '.part')
+        cached = {
+            'expires_at': time.time() + self.search_cache_ttl,
+            'scenes': scenes
+        }
+        
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(part_path, 'wb') as f:
+                f.write(json_dumps(cached))
+            os.replace(part_path, cache_path)
+        except OSError as e:
+            self.logger.warning(f"Could not cache scene search: {e}")
+    
+    def login(self, use_cache: bool = True) -> bool:
         """
         Autentica en M2M API y obtiene API key
         
+        Args:
+            use_cache: Si True y el cache de API key está habilitado, reutiliza un key vigente
+        
         Returns:
             bool: True si login exitoso, False en caso contrario
         
         Raises:
             requests.RequestException: Si hay error de red
         """
+        if self.cache_api_key and use_cache:
+            cached_key = self._load_cached_api_key()
+            if cached_key:
+                self.api_key = cached_key
+                self._api_key_from_cache = True
+                self.logger.info(f"Reusing cached M2M API key for {self.username}")
+                return True
+        
         login_url = f"{self.base_url}login-token"
         payload = {
             "username": self.username,
@@ -133,22 +350,28 @@ class M2MClient:
         try:
             response = self.session.post(
                 login_url,
-                json=payload,
+                data=json_dumps(payload),
+                headers={'Content-Type': 'application/json'},
                 timeout=self.timeout
             )
             response.raise_for_status()
             
-            data = response.json()
+            data = json_loads(response.content)
             
             if data.get('errorCode'):
                 self.logger.error(f"Login failed: {data['errorCode']} - {data['errorMessage']}")
                 return False
             
             self.api_key = data.get('data')
+            self._api_key_from_cache = False
             self.logger.info("Login successful, API key obtained")
+            
+            if self.cache_api_key:
+                self._store_cached_api_key()
+            
             return True
             
-        except requests.RequestException as e:
+        except (requests.RequestException, ValueError) as e:
             self.logger.error(f"Login request failed: {e}")
             raise
     
@@ -157,6 +380,12 @@ class M2MClient:
         if not self.api_key:
             return
         
+        if self.cache_api_key:
+            # Mantener el key vigente para la próxima ejecución; expira solo en M2M
+            self.logger.info("Keeping M2M session open for API key cache")
+            self.api_key = None
+            return
+        
         logout_url = f"{self.base_url}logout"
         headers = {'X-Auth-Token': self.api_key}
         
@@ -191,20 +420,34 @@ class M2MClient:
             raise RuntimeError("Not logged in. Call login() first.")
         
         url = f"{self.base_url}{endpoint}"
-        headers = {'X-Auth-Token': self.api_key}
+        api_key = self.api_key
+        headers = {
+            'X-Auth-Token': api_key,
+            'Content-Type': 'application/json'
+        }
         
         try:
             response = self.session.post(
                 url,
-                json=payload,
+                data=json_dumps(payload),
                 headers=headers,
                 timeout=self.timeout
             )
-            response.raise_for_status()
             
-            data = response.json()
+            try:
+                response.raise_for_status()
+            except requests.HTTPError:
+                # M2M también puede rechazar el key con un status HTTP de error
+                if self._relogin(api_key, self._get_error_code(response)):
+                    return self._send_request(endpoint, payload, exit_on_error, return_full_response)
+                raise
+            
+            data = json_loads(response.content)
             
             if data.get('errorCode'):
+                if self._relogin(api_key, data['errorCode']):
+                    return self._send_request(endpoint, payload, exit_on_error, return_full_response)
+                
                 self.logger.error(f"API error on {endpoint}: {data['errorCode']} - {data['errorMessage']}")
                 if exit_on_error:
                     sys.exit(1)
@@ -214,7 +457,7 @@ class M2MClient:
                 return data
             return data.get('data')
             
-        except requests.RequestException as e:
+        except (requests.RequestException, ValueError) as e:
             response_text = "N/A"
             if hasattr(e, 'response') and e.response is not None:
                 response_text = e.response.text
@@ -224,6 +467,54 @@ class M2MClient:
                 sys.exit(1)
             return None
     
+    def _get_error_code(self, response: requests.Response) -> Optional[str]:
+        """
+        Extrae el errorCode del cuerpo JSON de una respuesta M2M
+        
+        Args:
+            response: Respuesta de la API
+        
+        Returns:
+            Optional[str]: errorCode o None si el cuerpo no es JSON o no lo trae
+        """
+        try:
+            data = json_loads(response.content)
+        except ValueError:
+            return None
+        
+        return data.get('errorCode') if isinstance(data, dict) else None
+    
+    def _relogin(self, rejected_key: str, error_code: Optional[str]) -> bool:
+        """
+        Re-autentica si M2M rechazó un API key cacheado
+        
+        Varios hilos pueden recibir el rechazo del mismo key: solo el primero hace login y
+        el resto reintenta con el key nuevo.
+        
+        Args:
+            rejected_key: API key con el que se envió el request rechazado
+            error_code: errorCode devuelto por M2M
+        
+        Returns:
+            bool: True si hay un key distinto con el que reintentar el request
+        """
+        if not str(error_code or '').startswith('AUTH_'):
+            return False
+        
+        with self._login_lock:
+            if self.api_key != rejected_key:
+                # Otro hilo ya re-autenticó mientras este request estaba en curso
+                return bool(self.api_key)
+            
+            if not self._api_key_from_cache:
+                return False
+            
+            # El key cacheado fue revocado: re-autenticar y reintentar una sola vez
+            self.logger.info(f"Cached API key rejected ({error_code}), logging in again")
+            self._clear_cached_api_key()
+            self._api_key_from_cache = False
+            return self.login(use_cache=False)
+    
     def search_scenes(
         self,
         dataset_name: str,
@@ -262,11 +553,21 @@ class M2MClient:
             f"from {temporal_filter['start']} to {temporal_filter['end']}"
         )
         
+        if self.search_cache_ttl > 0:
+            cached_scenes = self._load_cached_search(payload)
+            if cached_scenes is not None:
+                self.logger.info(f"Found {len(cached_scenes)} scenes (cached)")
+                return cached_scenes
+        
         result = self._send_request('scene-search', payload)
         
         if result:
             scenes = result.get('results', [])
             self.logger.info(f"Found {len(scenes)} scenes")
+            
+            if self.search_cache_ttl > 0:
+                self._store_cached_search(payload, scenes)
+            
             return scenes
         
         return []
@@ -288,23 +589,29 @@ class M2MClient:
         Returns:
             int: Número de escenas añadidas
         """
-        payload = {
-            'listId': list_id,
-            'idField': 'entityId',
-            'entityIds': entity_ids,
-            'datasetName': dataset_name
-        }
-        
         self.logger.info(f"Adding {len(entity_ids)} scenes to list {list_id}")
         
-        result = self._send_request('scene-list-add', payload)
+        total_added = 0
         
-        if result:
-            count = result if isinstance(result, int) else len(entity_ids)
-            self.logger.info(f"Added {count} scenes to list")
-            return count
+        # Enviar en lotes para acotar el tamaño de cada payload en búsquedas grandes
+        for start in range(0, len(entity_ids), self.SCENE_LIST_BATCH_SIZE):
+            batch = entity_ids[start:start + self.SCENE_LIST_BATCH_SIZE]
+            payload = {
+                'listId': list_id,
+                'idField': 'entityId',
+                'entityIds': batch,
+                'datasetName': dataset_name
+            }
+            
+            result = self._send_request('scene-list-add', payload)
+            
+            if result:
+                total_added += result if isinstance(result, int) else len(batch)
+        
+        if total_added:
+            self.logger.info(f"Added {total_added} scenes to list")
         
-        return 0
+        return total_added
     
     def get_download_options(
         self,
@@ -353,22 +660,24 @@ class M2MClient:
             band_names: Lista de nombres de bandas a descargar (ej: ['SR_B3', 'SR_B6', 'QA_PIXEL'])
         
         Returns:
-            List[Dict]: Lista de descargas filtradas con formato {'entityId': str, 'productId': str}
+            List[Dict]: Lista de descargas filtradas con formato
+                {'entityId': str, 'productId': str, 'displayId': str} (displayId es el nombre del archivo)
         """
-        downloads = []
+        band_names = tuple(band for band in band_names if band)
+        if not band_names:
+            self.logger.info(f"Filtered 0 bands from {len(products)} products")
+            return []
         
-        for product in products:
-            # Verificar secondary downloads (bandas individuales)
-            if product.get('secondaryDownloads'):
-                for sd in product['secondaryDownloads']:
-                    display_id = sd.get('displayId', '')
-                    
-                    # Verificar si la banda está en la lista
-                    if any(band in display_id for band in band_names):
-                        downloads.append({
-                            'entityId': sd['entityId'],
-                            'productId': sd['id']
-                        })
+        # Una sola alternancia compilada (cacheada por lista de bandas): cada displayId se recorre una vez en C
+        band_pattern = _compile_band_pattern(band_names)
+        
+        # Secondary downloads (bandas individuales) cuyo displayId contiene alguna banda pedida
+        downloads = [
+            {'entityId': sd['entityId'], 'productId': sd['id'], 'displayId': sd.get('displayId')}
+            for product in products
+            for sd in product.get('secondaryDownloads') or ()
+            if band_pattern.search(sd.get('displayId', ''))
+        ]
         
         self.logger.info(f"Filtered {len(downloads)} bands from {len(products)} products")
         return downloads
@@ -391,8 +700,12 @@ class M2MClient:
         if not label:
             label = time.strftime("%Y%m%d_%H%M%S")
         
+        # La API solo espera entityId/productId; displayId es de uso local
         payload = {
-            'downloads': downloads,
+            'downloads': [
+                {'entityId': dl['entityId'], 'productId': dl['productId']}
+                for dl in downloads
+            ],
             'label': label
         }
         
@@ -451,7 +764,8 @@ class M2MClient:
         self,
         url: str,
         output_dir: Path,
-        entity_id: str
+        entity_id: str,
+        filename: Optional[str] = None
     ) -> Tuple[bool, Optional[Path], Optional[str], str, Optional[float]]:
         """
         Descarga un archivo desde una URL
@@ -460,6 +774,7 @@ class M2MClient:
             url: URL de descarga
             output_dir: Directorio donde guardar el archivo
             entity_id: Entity ID para logging
+            filename: Nombre conocido del archivo (displayId); si es None se toma de los headers o la URL
         
         Returns:
             Tuple[bool, Optional[Path], Optional[str], str, Optional[float]]: 
@@ -481,64 +796,118 @@ class M2MClient:
 
         start_time = time.time()
         download_duration_seconds = None
+        part_path = None
+        
+        # Usar el nombre conocido solo si es un nombre de archivo simple con extensión
+        if filename and (Path(filename).name != filename or not Path(filename).suffix):
+            filename = None
+        
         try:
-            self.logger.info(f"Downloading from {url}")
-            
-            response = self.session.get(url, stream=True, timeout=self.timeout)
-            response.raise_for_status()
+            # Reejecuciones con nombre conocido: comprobar el tamaño con HEAD antes de abrir el GET
+            if filename and self._is_already_downloaded(url, output_dir / filename):
+                download_duration_seconds = time.time() - start_time
+                filepath = output_dir / filename
+                self.logger.info(
+                    f"Already downloaded {filename} ({format_file_size(filepath.stat().st_size)}) for {entity_id}, skipping transfer"
+                )
+                return True, filepath, None, url, download_duration_seconds
             
-            # Intentar obtener nombre de archivo desde Content-Disposition
-            content_disposition = response.headers.get('content-disposition')
-            filename = None
+            self.logger.debug(f"Downloading from {url}")
             
-            if content_disposition:
-                # Ejemplo: attachment; filename="LC08_L2SP_..._SR_B1.TIF"
-                import re
-                fname_match = re.search(r'filename="?([^"]+)"?', content_disposition)
-                if fname_match:
-                    filename = fname_match.group(1)
-            
-            # Fallback: Extraer nombre de archivo desde URL si no hay header
-            if not filename:
-                parsed_url = urlparse(url)
-                filename = Path(unquote(parsed_url.path)).name
+            # El with garantiza que la respuesta se cierre en cualquier salida temprana.
+            # Se pide solo el primer rango; si el servidor no acepta rangos responde 200 con todo
+            with self.session.get(
+                url,
+                headers={
+                    'Range': f'bytes=0-{self.INITIAL_RANGE_BYTES - 1}',
+                    'Accept-Encoding': 'identity'
+                },
+                stream=True,
+                timeout=self.timeout
+            ) as response:
+                response.raise_for_status()
+                
+                # Intentar obtener nombre de archivo desde Content-Disposition
+                content_disposition = None if filename else response.headers.get('content-disposition')
                 
-            # Si aún no tenemos un nombre válido o es genérico, intentar inferir o loguear warning
-            if not filename or filename == 'download':
-                 # Último recurso, usar entity_id y timestamp para evitar sobreescritura, pero esto romperá el parser de bandas
-                 filename = f"unknown_file_{entity_id}_{int(time.time())}.dat"
-                 self.logger.warning(f"Could not determine filename for {entity_id}. Using: {filename}")
+                if content_disposition:
+                    # Ejemplo: attachment; filename="LC08_L2SP_..._SR_B1.TIF"
+                    fname_match = _FILENAME_RE.search(content_disposition)
+                    if fname_match:
+                        filename = fname_match.group(1)
+                
+                # Fallback: Extraer nombre de archivo desde URL si no hay header
+                if not filename:
+                    parsed_url = urlparse(url)
+                    filename = Path(unquote(parsed_url.path)).name
+                    
+                # Si aún no tenemos un nombre válido o es genérico, intentar inferir o loguear warning
+                if not filename or filename == 'download':
+                     # Último recurso, usar entity_id y timestamp para evitar sobreescritura, pero esto romperá el parser de bandas
+                     filename = f"unknown_file_{entity_id}_{int(time.time())}.dat"
+                     self.logger.warning(f"Could not determine filename for {entity_id}. Using: {filename}")
 
-            filepath = output_dir / filename
-            
-            # Verificar Content-Type. Si es JSON, probablemente es un error o redirección inesperada.
-            content_type = response.headers.get('Content-Type', '').lower()
-            if 'application/json' in content_type:
-                error_msg = f"Download failed for {entity_id}: Unexpected JSON response (Content-Type: {content_type}). Likely invalid/expired signature or file not found."
-                self.logger.error(error_msg)
-                if filepath.exists():
-                    filepath.unlink() # Eliminar archivo JSON incorrecto
-                return False, None, error_msg, url, None
-            
-            # Descargar con progress
-            total_size = int(response.headers.get('content-length', 0))
-            downloaded = 0
+                filepath = output_dir / filename
+                
+                # Verificar Content-Type. Si es JSON, probablemente es un error o redirección inesperada.
+                content_type = response.headers.get('Content-Type', '').lower()
+                if 'application/json' in content_type:
+                    error_msg = f"Download failed for {entity_id}: Unexpected JSON response (Content-Type: {content_type}). Likely invalid/expired signature or file not found."
+                    self.logger.error(error_msg)
+                    if filepath.exists():
+                        filepath.unlink() # Eliminar archivo JSON incorrecto
+                    return False, None, error_msg, url, None
+                
+                total_size = self._get_total_size(response)
+                
+                # Reejecuciones sin nombre conocido: solo se sabe el nombre tras el GET
+                if (
+                    total_size
+                    and not response.headers.get('content-encoding')
+                    and filepath.exists()
+                    and filepath.stat().st_size == total_size
+                ):
+                    download_duration_seconds = time.time() - start_time
+                    self.logger.info(
+                        f"Already downloaded {filename} ({format_file_size(total_size)}) for {entity_id}, skipping transfer"
+                    )
+                    return True, filepath, None, url, download_duration_seconds
+                
+                # Escribir a un .part y renombrar al final: un archivo con el nombre final
+                # siempre está completo, aunque el proceso muera a mitad de la descarga
+                part_path = filepath.with_name(filepath.name + '.part')
+                
+                partial = response.status_code == 206
+                
+                # Copiar el cuerpo directamente desde el socket (bucle en C, sin iterar chunks en Python)
+                response.raw.decode_content = not partial
+                
+                with open(part_path, 'wb', buffering=self.DOWNLOAD_CHUNK_SIZE) as f:
+                    shutil.copyfileobj(response.raw, f, length=self.DOWNLOAD_CHUNK_SIZE)
+                    received = f.tell()
+                    f.flush()
+                    os.fsync(f.fileno())
+                
+                if partial and received != min(self.INITIAL_RANGE_BYTES, total_size):
+                    raise RuntimeError(f"Incomplete initial range: got {received} bytes")
+                
+                range_url = response.url
             
-            with open(filepath, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                        downloaded += len(chunk)
+            # El resto del archivo se pide en rangos; la conexión del GET inicial ya está libre
+            if partial and received < total_size:
+                self._download_ranges(range_url, part_path, received, total_size)
             
             # Verificar tamaño
-            file_size = filepath.stat().st_size
+            file_size = part_path.stat().st_size
             
             if file_size == 0:
                 error_msg = f"Downloaded file is empty: {filepath}"
                 self.logger.warning(error_msg)
-                filepath.unlink()  # Eliminar archivo vacío
+                part_path.unlink()  # Eliminar archivo vacío
                 return False, None, error_msg, url, None
             
+            os.replace(part_path, filepath)
+            
             end_time = time.time()
             download_duration_seconds = end_time - start_time
 
@@ -551,56 +920,179 @@ class M2MClient:
         except Exception as e:
             end_time = time.time()
             download_duration_seconds = end_time - start_time # Still log duration even if it failed
+            if part_path is not None and part_path.exists():
+                part_path.unlink()  # No dejar descargas parciales en disco
             error_msg = f"Download failed for {entity_id}: {e}"
             self.logger.error(error_msg)
             return False, None, error_msg, url, download_duration_seconds
     
+    def _is_already_downloaded(self, url: str, filepath: Path) -> bool:
+        """
+        Indica si el archivo ya existe en disco con el tamaño que reporta el servidor
+        
+        Usa un HEAD, así no se abre (ni se descarta a medio leer) un GET por archivo omitido.
+        
+        Args:
+            url: URL de descarga
+            filepath: Ruta final del archivo
+        
+        Returns:
+            bool: True si el archivo local está completo; False si no existe o no se pudo verificar
+        """
+        if not filepath.exists():
+            return False
+        
+        try:
+            with self.session.head(url, allow_redirects=True, timeout=self.timeout) as response:
+                if not response.ok:
+                    return False
+                headers = response.headers
+        except requests.exceptions.RequestException:
+            return False
+        
+        try:
+            total_size = int(headers.get('content-length', 0) or 0)
+        except ValueError:
+            return False
+        
+        return bool(
+            total_size
+            and not headers.get('content-encoding')
+            and 'application/json' not in headers.get('Content-Type', '').lower()
+            and filepath.stat().st_size == total_size
+        )
+    
+    def _get_total_size(self, response: requests.Response) -> int:
+        """
+        Obtiene el tamaño total del archivo de la respuesta GET inicial
+        
+        Args:
+            response: Respuesta GET (stream) ya iniciada, completa (200) o parcial (206)
+        
+        Returns:
+            int: Tamaño en bytes (0 si el servidor no lo informa)
+        
+        Raises:
+            RuntimeError: Si una respuesta parcial no empieza en el byte 0 o no informa el total
+        """
+        if response.status_code != 206:
+            return int(response.headers.get('content-length', 0))
+        
+        match = _CONTENT_RANGE_RE.match(response.headers.get('content-range', ''))
+        if not match or int(match.group(1)) != 0:
+            raise RuntimeError(f"Unexpected Content-Range: {response.headers.get('content-range')}")
+        
+        return int(match.group(3))
+    
+    def _download_ranges(self, url: str, part_path: Path, offset: int, total_size: int):
+        """
+        Completa un archivo descargado hasta offset con rangos HTTP concurrentes
+        
+        Los archivos de al menos RANGE_DOWNLOAD_MIN_BYTES se reparten en RANGE_DOWNLOAD_PARTS
+        rangos iguales (el primero ya viene en parte del GET inicial); los menores se completan
+        con un solo rango. Cada rango se escribe en su offset dentro del archivo preasignado.
+        
+        Args:
+            url: URL final de descarga (tras redirecciones)
+            part_path: Archivo temporal de destino, con los primeros offset bytes ya escritos
+            offset: Bytes ya descargados
+            total_size: Tamaño total en bytes
+        
+        Raises:
+            RuntimeError: Si el servidor ignora el rango o un rango llega incompleto
+        """
+        parts = self.RANGE_DOWNLOAD_PARTS if total_size >= self.RANGE_DOWNLOAD_MIN_BYTES else 1
+        range_size = -(-total_size // parts)
+        byte_ranges = [
+            (max(start, offset), min(start + range_size, total_size) - 1)
+            for start in range(0, total_size, range_size)
+            if min(start + range_size, total_size) > offset
+        ]
+        
+        with open(part_path, 'r+b') as f:
+            f.truncate(total_size)
+        
+        def fetch_range(byte_range: Tuple[int, int]):
+            start, end = byte_range
+            with self.session.get(
+                url,
+                headers={'Range': f'bytes={start}-{end}', 'Accept-Encoding': 'identity'},
+                stream=True,
+                timeout=self.timeout
+            ) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise RuntimeError(f"Server ignored Range request (HTTP {response.status_code})")
+                
+                with open(part_path, 'r+b') as f:
+                    f.seek(start)
+                    shutil.copyfileobj(response.raw, f, length=self.DOWNLOAD_CHUNK_SIZE)
+                    written = f.tell() - start
+            
+            if written != end - start + 1:
+                raise RuntimeError(f"Incomplete range {start}-{end}: got {written} bytes")
+        
+        self.logger.debug(f"Downloading {part_path.name} in {len(byte_ranges)} ranges")
+        
+        with ThreadPoolExecutor(max_workers=len(byte_ranges)) as executor:
+            list(executor.map(fetch_range, byte_ranges))
+        
+        with open(part_path, 'r+b') as f:
+            os.fsync(f.fileno())
+    
     def download_files_parallel(
         self,
         download_urls: List[Dict],
         output_dir: Path,
-        max_workers: int = 5
+        max_workers: int = 8
     ) -> List[Tuple[str, bool, Optional[Path], Optional[str], str, Optional[float]]]:
         """
         Descarga múltiples archivos en paralelo
         
         Args:
-            download_urls: Lista de dicts con 'url' y 'entityId'
+            download_urls: Lista de dicts con 'url', 'entityId' y opcionalmente 'filename'
             output_dir: Directorio de salida
-            max_workers: Número de descargas concurrentes
+            max_workers: Número máximo de descargas concurrentes (se limita al número de archivos)
         
         Returns:
             List[Tuple[str, bool, Optional[Path], Optional[str], str, Optional[float]]]: 
-                Lista de (entity_id, éxito, ruta, error, url, duración_descarga)
+                Lista de (entity_id, éxito, ruta, error, url, duración_descarga), en el orden de download_urls
         """
-        output_dir.mkdir(parents=True, exist_ok=True)
-        results = []
+        if not self.dry_run:
+            output_dir.mkdir(parents=True, exist_ok=True)
+        results: List[Optional[Tuple]] = [None] * len(download_urls)
+        successful = 0
+        
+        # No crear más hilos que archivos: cada worker pasa casi todo el tiempo bloqueado en red
+        workers = max(1, min(max_workers, len(download_urls)))
         
-        self.logger.info(f"Starting parallel download of {len(download_urls)} files")
+        self.logger.info(f"Starting parallel download of {len(download_urls)} files ({workers} workers)")
         
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
             futures = {
                 executor.submit(
                     self.download_file,
                     item['url'],
                     output_dir,
-                    item['entityId']
-                ): item
-                for item in download_urls
+                    item['entityId'],
+                    item.get('filename')
+                ): index
+                for index, item in enumerate(download_urls)
             }
             
             for future in as_completed(futures):
-                item = futures[future]
+                index = futures[future]
+                item = download_urls[index]
                 entity_id = item['entityId']
                 original_url = item['url']
                 try:
                     success, filepath, error, url_returned, duration = future.result()
-                    results.append((entity_id, success, filepath, error, url_returned, duration))
+                    results[index] = (entity_id, success, filepath, error, url_returned, duration)
+                    successful += bool(success)
                 except Exception as e:
                     self.logger.error(f"Unexpected error for {entity_id} (URL: {original_url}): {e}")
-                    results.append((entity_id, False, None, str(e), original_url, None))
+                    results[index] = (entity_id, False, None, str(e), original_url, None)
         
-        successful = sum(1 for _, success, _, _, _, _ in results if success)
         self.logger.info(f"Download completed: {successful}/{len(download_urls)} successful")
         
         return results
@@ -630,32 +1122,18 @@ def get_required_bands_for_sensor(sensor: str, config: Optional[Dict] = None) ->
     Returns:
         List[str]: Lista de nombres de bandas
     """
-    if config is None:
-        config = load_config()
-    
-    # Mapeo de sensores a datasets
-    sensor_to_dataset = {
-        'OLI': 'landsat_8_9',
-        'ETM+': 'landsat_7',
-        'TM': 'landsat_5'
-    }
-    
-    dataset_key = sensor_to_dataset.get(sensor)
+    dataset_key = _SENSOR_TO_DATASET.get(sensor)
     if not dataset_key:
         return []
     
+    if config is None:
+        config = load_config()
+    
     dataset_config = config.get('datasets', {}).get(dataset_key, {})
     bands = dataset_config.get('bands', {})
     
     # Retornar todas las bandas configuradas
-    return [
-        bands.get('green'),
-        bands.get('swir1'),
-        bands.get('qa_pixel'),
-        bands.get('qa_radsat'),
-        bands.get('qa_aerosol'),
-        bands.get('metadata')
-    ]
+    return [bands.get(key) for key in _BAND_ORDER]
 
 
 if __name__ == '__main__':
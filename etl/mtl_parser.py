@@ -3,12 +3,29 @@ Parser para archivos de metadatos MTL de Landsat Collection 2
 Soporta formatos .txt y .xml
 """
 
-import re
+import sys
 import xml.etree.ElementTree as ET
 from pathlib import Path
-from typing import Dict, Optional, Union
+from typing import Dict, Iterable, List, Optional, Union
 from datetime import datetime
+from functools import cached_property
+from concurrent.futures import ProcessPoolExecutor
 
+# Formatos de fecha presentes en los MTL
+_DATE_FORMAT = '%Y-%m-%d'
+_DOY_DATETIME_FORMAT = '%Y:%j:%H:%M:%S.%f'
+
+# Dataset M2M por nave (SPACECRAFT_ID del MTL)
+_DATASET_BY_SPACECRAFT = {
+    'LANDSAT_8': 'landsat_ot_c2_l2',
+    'LANDSAT_9': 'landsat_ot_c2_l2',
+    'LANDSAT_7': 'landsat_etm_c2_l2',
+    'LANDSAT_4': 'landsat_tm_c2_l2',
+    'LANDSAT_5': 'landsat_tm_c2_l2',
+}
+
+# Longitud máxima de los valores de texto que se internan
+_INTERN_MAX_LEN = 32
 
 class MTLParser:
     """
@@ -31,6 +48,98 @@ class MTLParser:
         </LANDSAT_METADATA_FILE>
     """
     
+    # Variantes de clave por campo, en orden de prioridad (C2 TXT/XML, C1 y L1 antiguos)
+    _FIELD_VARIANTS = {
+        'entity_id': (
+            'PRODUCT_CONTENTS.LANDSAT_PRODUCT_ID',
+            'PRODUCT_METADATA.LANDSAT_PRODUCT_ID',
+            'L1_METADATA_FILE.METADATA_FILE_INFO.LANDSAT_PRODUCT_ID',
+        ),
+        'display_id': (
+            'PRODUCT_CONTENTS.LANDSAT_SCENE_ID',
+            'PRODUCT_METADATA.LANDSAT_SCENE_ID',
+            'L1_METADATA_FILE.METADATA_FILE_INFO.LANDSAT_SCENE_ID',
+        ),
+        'date_acquired': (
+            'IMAGE_ATTRIBUTES.DATE_ACQUIRED',
+            'PRODUCT_METADATA.DATE_ACQUIRED',
+            'L1_METADATA_FILE.PRODUCT_METADATA.DATE_ACQUIRED',
+        ),
+        'cloud_cover': (
+            'IMAGE_ATTRIBUTES.CLOUD_COVER',
+            'IMAGE_ATTRIBUTES.CLOUD_COVER_LAND',
+            'PRODUCT_METADATA.CLOUD_COVER',
+            'L1_METADATA_FILE.IMAGE_ATTRIBUTES.CLOUD_COVER',
+        ),
+        'sun_azimuth': (
+            'IMAGE_ATTRIBUTES.SUN_AZIMUTH',
+            'PRODUCT_METADATA.SUN_AZIMUTH',
+            'L1_METADATA_FILE.IMAGE_ATTRIBUTES.SUN_AZIMUTH',
+        ),
+        'sun_elevation': (
+            'IMAGE_ATTRIBUTES.SUN_ELEVATION',
+            'PRODUCT_METADATA.SUN_ELEVATION',
+            'L1_METADATA_FILE.IMAGE_ATTRIBUTES.SUN_ELEVATION',
+        ),
+        'wrs_path': (
+            'IMAGE_ATTRIBUTES.WRS_PATH',
+            'PRODUCT_METADATA.WRS_PATH',
+            'L1_METADATA_FILE.PRODUCT_METADATA.WRS_PATH',
+        ),
+        'wrs_row': (
+            'IMAGE_ATTRIBUTES.WRS_ROW',
+            'PRODUCT_METADATA.WRS_ROW',
+            'L1_METADATA_FILE.PRODUCT_METADATA.WRS_ROW',
+        ),
+        'processing_level': (
+            'PRODUCT_CONTENTS.PROCESSING_LEVEL',
+            'PRODUCT_METADATA.PROCESSING_LEVEL',
+            'L1_METADATA_FILE.PRODUCT_METADATA.DATA_TYPE',
+        ),
+        'spacecraft_id': (
+            'IMAGE_ATTRIBUTES.SPACECRAFT_ID',
+            'PRODUCT_METADATA.SPACECRAFT_ID',
+            'L1_METADATA_FILE.PRODUCT_METADATA.SPACECRAFT_ID',
+        ),
+        'sensor_id': (
+            'IMAGE_ATTRIBUTES.SENSOR_ID',
+            'PRODUCT_METADATA.SENSOR_ID',
+            'L1_METADATA_FILE.PRODUCT_METADATA.SENSOR_ID',
+        ),
+        'corner_ul_lat': (
+            'PROJECTION_ATTRIBUTES.CORNER_UL_LAT_PRODUCT',
+            'PRODUCT_METADATA.CORNER_UL_LAT_PRODUCT',
+        ),
+        'corner_ul_lon': (
+            'PROJECTION_ATTRIBUTES.CORNER_UL_LON_PRODUCT',
+            'PRODUCT_METADATA.CORNER_UL_LON_PRODUCT',
+        ),
+        'corner_ur_lat': (
+            'PROJECTION_ATTRIBUTES.CORNER_UR_LAT_PRODUCT',
+            'PRODUCT_METADATA.CORNER_UR_LAT_PRODUCT',
+        ),
+        'corner_ur_lon': (
+            'PROJECTION_ATTRIBUTES.CORNER_UR_LON_PRODUCT',
+            'PRODUCT_METADATA.CORNER_UR_LON_PRODUCT',
+        ),
+        'corner_lr_lat': (
+            'PROJECTION_ATTRIBUTES.CORNER_LR_LAT_PRODUCT',
+            'PRODUCT_METADATA.CORNER_LR_LAT_PRODUCT',
+        ),
+        'corner_lr_lon': (
+            'PROJECTION_ATTRIBUTES.CORNER_LR_LON_PRODUCT',
+            'PRODUCT_METADATA.CORNER_LR_LON_PRODUCT',
+        ),
+        'corner_ll_lat': (
+            'PROJECTION_ATTRIBUTES.CORNER_LL_LAT_PRODUCT',
+            'PRODUCT_METADATA.CORNER_LL_LAT_PRODUCT',
+        ),
+        'corner_ll_lon': (
+            'PROJECTION_ATTRIBUTES.CORNER_LL_LON_PRODUCT',
+            'PRODUCT_METADATA.CORNER_LL_LON_PRODUCT',
+        ),
+    }
+    
     def __init__(self, mtl_path: Union[str, Path], dry_run: bool = False):
         """
         Inicializa el parser
@@ -41,11 +150,14 @@ class MTLParser:
         
         Raises:
             FileNotFoundError: Si el archivo no existe y no es dry_run
-            ValueError: Si el formato no es soportado y no es dry_run
+        
+        El formato se detecta de forma diferida en el primer parse().
         """
         self.mtl_path = Path(mtl_path)
         self.dry_run = dry_run
         self.metadata = {}
+        # En dry_run los metadatos simulados ya cuentan como parseados
+        self._parsed = bool(dry_run)
 
         if self.dry_run:
             self._set_mock_metadata()
@@ -53,9 +165,6 @@ class MTLParser:
         
         if not self.mtl_path.exists():
             raise FileNotFoundError(f"MTL file not found: {self.mtl_path}")
-        
-        self.format = self._detect_format()
-        self.metadata = {}
     
     def _set_mock_metadata(self):
         """
@@ -83,6 +192,11 @@ class MTLParser:
             'PROJECTION_ATTRIBUTES.CORNER_LL_LON_PRODUCT': -68.008472
         }
     
+    @cached_property
+    def format(self) -> str:
+        """Formato del archivo MTL ('txt' o 'xml'), detectado al primer acceso"""
+        return self._detect_format()
+    
     def _detect_format(self) -> str:
         """
         Detecta el formato del archivo MTL
@@ -111,16 +225,23 @@ class MTLParser:
     
     def parse(self) -> Dict:
         """
-        Parsea el archivo MTL según su formato
+        Parsea el archivo MTL según su formato (solo la primera vez)
         
         Returns:
             Dict: Diccionario con los metadatos parseados
+        
+        Raises:
+            ValueError: Si el formato no es soportado
         """
+        if self._parsed:
+            return self.metadata
+        
         if self.format == 'txt':
             self.metadata = self._parse_txt()
         else:
             self.metadata = self._parse_xml()
         
+        self._parsed = True
         return self.metadata
     
     def _parse_txt(self) -> Dict:
@@ -133,28 +254,38 @@ class MTLParser:
         metadata = {}
         current_group = None
         
-        with open(self.mtl_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                
-                if not line or line.startswith('END_GROUP'):
-                    continue
-                
-                if line.startswith('GROUP'):
-                    match = re.match(r'GROUP\s*=\s*(.+)', line)
-                    if match:
-                        current_group = match.group(1)
-                    continue
-                
-                match = re.match(r'(\w+)\s*=\s*(.+)', line)
-                if match:
-                    key = match.group(1)
-                    value = match.group(2).strip('"')
-                    
-                    if current_group:
-                        key = f"{current_group}.{key}"
-                    
-                    metadata[key] = self._convert_value(value)
+        # Los MTL pesan decenas de KB: se leen de una vez y se decodifican en bloque
+        with open(self.mtl_path, 'rb') as f:
+            content = f.read().decode('utf-8')
+        
+        for line in content.splitlines():
+            line = line.strip()
+            
+            if not line or line.startswith('END_GROUP'):
+                continue
+            
+            key, sep, value = line.partition('=')
+            if not sep:
+                continue
+            
+            key = key.strip()
+            value = value.strip()
+            
+            if line.startswith('GROUP'):
+                if key == 'GROUP' and value:
+                    current_group = value
+                continue
+            
+            # Solo claves alfanuméricas (equivalente a \w+) con valor no vacío
+            if not value or not key.replace('_', '').isalnum():
+                continue
+            
+            value = value.strip('"')
+            
+            if current_group:
+                key = f"{current_group}.{key}"
+            
+            metadata[sys.intern(key)] = self._convert_value(value)
         
         return metadata
     
@@ -165,21 +296,20 @@ class MTLParser:
         Returns:
             Dict: Metadatos parseados
         """
-        tree = ET.parse(self.mtl_path)
-        root = tree.getroot()
-        
         metadata = {}
-        
-        def parse_element(element, prefix=''):
-            for child in element:
-                key = f"{prefix}.{child.tag}" if prefix else child.tag
-                
-                if len(child) > 0:
-                    parse_element(child, key)
-                else:
-                    metadata[key] = self._convert_value(child.text)
-        
-        parse_element(root)
+        # Pila de tags abiertos; el elemento raíz no forma parte de las claves
+        stack = []
+        
+        for event, element in ET.iterparse(self.mtl_path, events=('start', 'end')):
+            if event == 'start':
+                stack.append(element.tag)
+                continue
+            
+            if len(stack) > 1 and len(element) == 0:
+                metadata[sys.intern('.'.join(stack[1:]))] = self._convert_value(element.text)
+            
+            stack.pop()
+            element.clear()
         
         return metadata
     
@@ -198,28 +328,40 @@ class MTLParser:
         
         value = value.strip('"')
         
-        if value.upper() in ('TRUE', 'YES'):
+        upper = value.upper()
+        if upper in ('TRUE', 'YES'):
             return True
-        if value.upper() in ('FALSE', 'NO'):
+        if upper in ('FALSE', 'NO'):
             return False
         
-        try:
-            if '.' in value:
-                return float(value)
-            return int(value)
-        except ValueError:
-            pass
-        
-        try:
-            return datetime.strptime(value, '%Y-%m-%d')
-        except ValueError:
-            pass
-        
-        try:
-            return datetime.strptime(value, '%Y:%j:%H:%M:%S.%f')
-        except ValueError:
-            pass
-        
+        # Solo se intenta la conversión numérica si el valor puede empezar como número
+        head = value.lstrip()[:1]
+        if head.isdigit() or head in ('+', '-', '.'):
+            try:
+                if '.' in value:
+                    return float(value)
+                return int(value)
+            except ValueError:
+                pass
+        
+        # Las fechas empiezan con un año de 4 dígitos; el separador indica el formato
+        if value[:1].isdigit():
+            separator = value[4:5]
+            date_format = None
+            if separator == '-':
+                date_format = _DATE_FORMAT
+            elif separator == ':':
+                date_format = _DOY_DATETIME_FORMAT
+            
+            if date_format:
+                try:
+                    return datetime.strptime(value, date_format)
+                except ValueError:
+                    pass
+        
+        # Valores cortos tipo enumerado (LANDSAT_8, OLI_TIRS, L2SP...) se repiten entre escenas
+        if len(value) < _INTERN_MAX_LEN:
+            return sys.intern(value)
         return value
     
     def get_scene_metadata(self) -> Dict:
@@ -229,146 +371,56 @@ class MTLParser:
         Returns:
             Dict: Metadatos estructurados para inserción en BD
         """
-        if not self.metadata:
+        if not self._parsed:
             self.parse()
         
-        def get_nested(key_variants):
+        metadata = self.metadata
+        fields = {}
+        for field, key_variants in self._FIELD_VARIANTS.items():
+            value = None
             for key in key_variants:
-                if key in self.metadata:
-                    return self.metadata[key]
-            return None
+                if key in metadata:
+                    value = metadata[key]
+                    break
+            fields[field] = value
         
-        entity_id = get_nested([
-            'PRODUCT_CONTENTS.LANDSAT_PRODUCT_ID',
-            'PRODUCT_METADATA.LANDSAT_PRODUCT_ID',
-            'L1_METADATA_FILE.METADATA_FILE_INFO.LANDSAT_PRODUCT_ID'
-        ])
-        
-        display_id = get_nested([
-            'PRODUCT_CONTENTS.LANDSAT_SCENE_ID',
-            'PRODUCT_METADATA.LANDSAT_SCENE_ID',
-            'L1_METADATA_FILE.METADATA_FILE_INFO.LANDSAT_SCENE_ID'
-        ])
-        
-        date_acquired = get_nested([
-            'IMAGE_ATTRIBUTES.DATE_ACQUIRED',
-            'PRODUCT_METADATA.DATE_ACQUIRED',
-            'L1_METADATA_FILE.PRODUCT_METADATA.DATE_ACQUIRED'
-        ])
-        
-        cloud_cover = get_nested([
-            'IMAGE_ATTRIBUTES.CLOUD_COVER',
-            'IMAGE_ATTRIBUTES.CLOUD_COVER_LAND',
-            'PRODUCT_METADATA.CLOUD_COVER',
-            'L1_METADATA_FILE.IMAGE_ATTRIBUTES.CLOUD_COVER'
-        ])
-        
-        sun_azimuth = get_nested([
-            'IMAGE_ATTRIBUTES.SUN_AZIMUTH',
-            'PRODUCT_METADATA.SUN_AZIMUTH',
-            'L1_METADATA_FILE.IMAGE_ATTRIBUTES.SUN_AZIMUTH'
-        ])
-        
-        sun_elevation = get_nested([
-            'IMAGE_ATTRIBUTES.SUN_ELEVATION',
-            'PRODUCT_METADATA.SUN_ELEVATION',
-            'L1_METADATA_FILE.IMAGE_ATTRIBUTES.SUN_ELEVATION'
-        ])
-        
-        wrs_path = get_nested([
-            'IMAGE_ATTRIBUTES.WRS_PATH',
-            'PRODUCT_METADATA.WRS_PATH',
-            'L1_METADATA_FILE.PRODUCT_METADATA.WRS_PATH'
-        ])
-        
-        wrs_row = get_nested([
-            'IMAGE_ATTRIBUTES.WRS_ROW',
-            'PRODUCT_METADATA.WRS_ROW',
-            'L1_METADATA_FILE.PRODUCT_METADATA.WRS_ROW'
-        ])
-        
-        processing_level = get_nested([
-            'PRODUCT_CONTENTS.PROCESSING_LEVEL',
-            'PRODUCT_METADATA.PROCESSING_LEVEL',
-            'L1_METADATA_FILE.PRODUCT_METADATA.DATA_TYPE'
-        ])
-        
-        spacecraft_id = get_nested([
-            'IMAGE_ATTRIBUTES.SPACECRAFT_ID',
-            'PRODUCT_METADATA.SPACECRAFT_ID',
-            'L1_METADATA_FILE.PRODUCT_METADATA.SPACECRAFT_ID'
-        ])
-        
-        sensor_id = get_nested([
-            'IMAGE_ATTRIBUTES.SENSOR_ID',
-            'PRODUCT_METADATA.SENSOR_ID',
-            'L1_METADATA_FILE.PRODUCT_METADATA.SENSOR_ID'
-        ])
-        
-        corner_ul_lat = get_nested([
-            'PROJECTION_ATTRIBUTES.CORNER_UL_LAT_PRODUCT',
-            'PRODUCT_METADATA.CORNER_UL_LAT_PRODUCT'
-        ])
-        corner_ul_lon = get_nested([
-            'PROJECTION_ATTRIBUTES.CORNER_UL_LON_PRODUCT',
-            'PRODUCT_METADATA.CORNER_UL_LON_PRODUCT'
-        ])
-        corner_ur_lat = get_nested([
-            'PROJECTION_ATTRIBUTES.CORNER_UR_LAT_PRODUCT',
-            'PRODUCT_METADATA.CORNER_UR_LAT_PRODUCT'
-        ])
-        corner_ur_lon = get_nested([
-            'PROJECTION_ATTRIBUTES.CORNER_UR_LON_PRODUCT',
-            'PRODUCT_METADATA.CORNER_UR_LON_PRODUCT'
-        ])
-        corner_lr_lat = get_nested([
-            'PROJECTION_ATTRIBUTES.CORNER_LR_LAT_PRODUCT',
-            'PRODUCT_METADATA.CORNER_LR_LAT_PRODUCT'
-        ])
-        corner_lr_lon = get_nested([
-            'PROJECTION_ATTRIBUTES.CORNER_LR_LON_PRODUCT',
-            'PRODUCT_METADATA.CORNER_LR_LON_PRODUCT'
-        ])
-        corner_ll_lat = get_nested([
-            'PROJECTION_ATTRIBUTES.CORNER_LL_LAT_PRODUCT',
-            'PRODUCT_METADATA.CORNER_LL_LAT_PRODUCT'
-        ])
-        corner_ll_lon = get_nested([
-            'PROJECTION_ATTRIBUTES.CORNER_LL_LON_PRODUCT',
-            'PRODUCT_METADATA.CORNER_LL_LON_PRODUCT'
-        ])
+        corner_ul_lon, corner_ul_lat = fields['corner_ul_lon'], fields['corner_ul_lat']
+        corner_ur_lon, corner_ur_lat = fields['corner_ur_lon'], fields['corner_ur_lat']
+        corner_lr_lon, corner_lr_lat = fields['corner_lr_lon'], fields['corner_lr_lat']
+        corner_ll_lon, corner_ll_lat = fields['corner_ll_lon'], fields['corner_ll_lat']
         
         footprint_wkt = None
         if all([corner_ul_lon, corner_ul_lat, corner_ur_lon, corner_ur_lat,
                 corner_lr_lon, corner_lr_lat, corner_ll_lon, corner_ll_lat]):
-            footprint_wkt = (
-                f"POLYGON(("
-                f"{corner_ul_lon} {corner_ul_lat}, "
-                f"{corner_ur_lon} {corner_ur_lat}, "
-                f"{corner_lr_lon} {corner_lr_lat}, "
-                f"{corner_ll_lon} {corner_ll_lat}, "
-                f"{corner_ul_lon} {corner_ul_lat}"
-                f"))"
+            # Anillo cerrado: el primer vértice se repite al final
+            ring = (
+                (corner_ul_lon, corner_ul_lat),
+                (corner_ur_lon, corner_ur_lat),
+                (corner_lr_lon, corner_lr_lat),
+                (corner_ll_lon, corner_ll_lat),
+                (corner_ul_lon, corner_ul_lat),
             )
+            footprint_wkt = "POLYGON((" + ", ".join(f"{lon} {lat}" for lon, lat in ring) + "))"
         
+        wrs_path, wrs_row = fields['wrs_path'], fields['wrs_row']
         path_row = None
         if wrs_path and wrs_row:
             path_row = f"{wrs_path:03d}/{wrs_row:03d}"
         
-        dataset_name = self._infer_dataset_name(spacecraft_id, sensor_id)
+        dataset_name = self._infer_dataset_name(fields['spacecraft_id'], fields['sensor_id'])
         
         return {
-            'entity_id': entity_id,
-            'display_id': display_id or entity_id,
+            'entity_id': fields['entity_id'],
+            'display_id': fields['display_id'] or fields['entity_id'],
             'dataset_name': dataset_name,
-            'sensor': sensor_id,
-            'satellite': spacecraft_id,
-            'acquisition_date': date_acquired,
+            'sensor': fields['sensor_id'],
+            'satellite': fields['spacecraft_id'],
+            'acquisition_date': fields['date_acquired'],
             'path_row': path_row,
-            'cloud_cover': cloud_cover,
-            'sun_azimuth': sun_azimuth,
-            'sun_elevation': sun_elevation,
-            'processing_level': processing_level,
+            'cloud_cover': fields['cloud_cover'],
+            'sun_azimuth': fields['sun_azimuth'],
+            'sun_elevation': fields['sun_elevation'],
+            'processing_level': fields['processing_level'],
             'footprint_wkt': footprint_wkt,
             'metadata_full': self.metadata
         }
@@ -389,12 +441,14 @@ class MTLParser:
         
         spacecraft_id = spacecraft_id.upper()
         
-        if 'LANDSAT_8' in spacecraft_id or 'LANDSAT_9' in spacecraft_id:
-            return 'landsat_ot_c2_l2'
-        elif 'LANDSAT_7' in spacecraft_id:
-            return 'landsat_etm_c2_l2'
-        elif 'LANDSAT_4' in spacecraft_id or 'LANDSAT_5' in spacecraft_id:
-            return 'landsat_tm_c2_l2'
+        dataset_name = _DATASET_BY_SPACECRAFT.get(spacecraft_id)
+        if dataset_name:
+            return dataset_name
+        
+        # Valores no estándar que contienen el ID de la nave (se respeta el orden de la tabla)
+        for spacecraft, dataset_name in _DATASET_BY_SPACECRAFT.items():
+            if spacecraft in spacecraft_id:
+                return dataset_name
         
         return 'unknown'
 
@@ -413,6 +467,27 @@ def parse_mtl_file(mtl_path: Union[str, Path]) -> Dict:
     return parser.get_scene_metadata()
 
 
+def parse_mtl_files(mtl_paths: Iterable[Union[str, Path]], workers: Optional[int] = None) -> List[Dict]:
+    """
+    Parsea varios archivos MTL en paralelo con un pool de procesos
+    
+    Args:
+        mtl_paths: Rutas a los archivos MTL
+        workers: Número de procesos (por defecto, uno por CPU)
+    
+    Returns:
+        List[Dict]: Metadatos estructurados, en el mismo orden que mtl_paths
+    """
+    mtl_paths = list(mtl_paths)
+    
+    # Con un solo archivo no compensa levantar procesos
+    if len(mtl_paths) <= 1:
+        return [parse_mtl_file(path) for path in mtl_paths]
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(parse_mtl_file, mtl_paths, chunksize=8))
+
+
 if __name__ == '__main__':
     """Test del parser MTL"""
     import sys
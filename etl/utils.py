@@ -3,26 +3,43 @@ Utilidades compartidas para el sistema ETL de Landsat
 Proporciona funciones para paths, logging, configuración y helpers GeoJSON
 """
 
+import os
 import sys
 import json
+import queue
+import atexit
 import logging
+import logging.handlers
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 from urllib.parse import quote_plus
 
 import yaml
 from dotenv import dotenv_values
 
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:  # PyYAML sin libyaml: se usa el loader en Python puro
+    from yaml import SafeLoader as _YamlLoader
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional: se usa json de la stdlib como respaldo
+    orjson = None
+
 
 # =====================================================
 # PATHS Y CONFIGURACIÓN
 # =====================================================
 
+@lru_cache(maxsize=1)
 def get_project_root() -> Path:
     """
     Obtiene el directorio raíz del proyecto.
     Busca desde el archivo actual hacia arriba hasta encontrar .env
+    (el resultado se cachea durante el proceso)
     
     Returns:
         Path: Ruta absoluta al directorio raíz del proyecto
@@ -38,30 +55,113 @@ def get_project_root() -> Path:
     return current.parent.parent
 
 
+@lru_cache(maxsize=1)
 def get_config_path() -> Path:
     """Retorna la ruta al archivo de configuración YAML principal"""
     return get_project_root() / 'config' / 'landsat_config.yaml'
 
 
+@lru_cache(maxsize=1)
 def get_env_path() -> Path:
     """Retorna la ruta al archivo .env para secretos"""
     return get_project_root() / '.env'
 
 
+def _get_config_cache_path(config_path: Path) -> Path:
+    """Retorna la ruta del cache JSON de la configuración (junto al YAML)"""
+    return config_path.with_suffix('.cache.json')
+
+
+def _config_stamp(config_stat: os.stat_result) -> List[int]:
+    """Identifica una versión del YAML de configuración por su mtime (ns) y tamaño"""
+    return [config_stat.st_mtime_ns, config_stat.st_size]
+
+
+def _load_cached_config(config_path: Path, config_stat: os.stat_result) -> Optional[Dict]:
+    """
+    Carga la configuración desde el cache JSON si fue generado a partir de este mismo YAML
+    
+    El cache guarda el mtime y el tamaño del YAML del que proviene y se exige igualdad:
+    un YAML restaurado con un mtime anterior (cp -p, tar, rsync -t) también lo invalida.
+    
+    Args:
+        config_path: Ruta al YAML de configuración
+        config_stat: Resultado de stat() del YAML
+    
+    Returns:
+        Optional[Dict]: Configuración cacheada, o None si no existe o está desactualizada
+    """
+    cache_path = _get_config_cache_path(config_path)
+    try:
+        with open(cache_path, 'rb') as f:
+            cached = json_loads(f.read())
+    except (OSError, ValueError):
+        return None
+    
+    if not isinstance(cached, dict) or cached.get('source') != _config_stamp(config_stat):
+        return None
+    return cached.get('config')
+
+
+def _store_cached_config(config_path: Path, config_stat: os.stat_result, config: Dict):
+    """
+    Guarda la configuración parseada como JSON junto al YAML (escritura atómica)
+    
+    Solo se guarda si el JSON reproduce exactamente la configuración
+    (p. ej. no hay fechas ni claves numéricas en el YAML).
+    
+    Args:
+        config_path: Ruta al YAML de configuración
+        config_stat: Resultado de stat() del YAML, tomado antes de leerlo
+        config: Configuración parseada
+    """
+    cache_path = _get_config_cache_path(config_path)
+    part_path = cache_path.with_name(cache_path.name + '.part')
+    
+    try:
+        data = json_dumps({'source': _config_stamp(config_stat), 'config': config})
+        if json_loads(data)['config'] != config:
+            return
+        with open(part_path, 'wb') as f:
+            f.write(data)
+        os.replace(part_path, cache_path)
+    except (OSError, TypeError, ValueError):
+        # El cache es opcional: sin permisos de escritura se sigue usando el YAML
+        pass
+
+
+@lru_cache(maxsize=1)
 def load_config() -> Dict:
     """
     Carga la configuración principal desde etl_config.yaml
+    
+    El YAML parseado se guarda en un cache JSON (landsat_config.cache.json) que se
+    reutiliza mientras el mtime y el tamaño del YAML coincidan con los guardados.
+    El resultado se cachea durante el proceso: no modificar el diccionario retornado.
     """
     config_path = get_config_path()
-    if not config_path.exists():
+    try:
+        config_stat = config_path.stat()
+    except FileNotFoundError:
         raise FileNotFoundError(f"Config file not found: {config_path}")
+    
+    config = _load_cached_config(config_path, config_stat)
+    if config is not None:
+        return config
+    
     with open(config_path, 'r', encoding='utf-8') as f:
-        return yaml.safe_load(f)
+        config = yaml.load(f, Loader=_YamlLoader)
+    
+    _store_cached_config(config_path, config_stat, config)
+    return config
 
 
+@lru_cache(maxsize=1)
 def load_env() -> Dict[str, str]:
     """
     Carga los secretos desde .env
+    
+    El resultado se cachea durante el proceso: no modificar el diccionario retornado.
     """
     env_path = get_env_path()
     if not env_path.exists():
@@ -70,9 +170,12 @@ def load_env() -> Dict[str, str]:
     return dotenv_values(env_path)
 
 
+@lru_cache(maxsize=1)
 def get_data_dirs() -> Dict[str, Path]:
     """
     Obtiene las rutas de datos desde la config, creándolos si no existen.
+    
+    Los directorios se crean una sola vez por proceso: no modificar el diccionario retornado.
     """
     config = load_config().get('STORAGE_PATHS', {})
     project_root = get_project_root()
@@ -88,10 +191,85 @@ def get_data_dirs() -> Dict[str, Path]:
     
     return dirs
 
+
+@lru_cache(maxsize=None)
+def get_m2m_name(dataset_key: str) -> Optional[str]:
+    """
+    Obtiene el nombre M2M de un dataset de la configuración
+    
+    Args:
+        dataset_key: Clave del dataset en la sección 'datasets' (ej: 'landsat_8_9')
+    
+    Returns:
+        Optional[str]: m2m_name del dataset (ej: 'landsat_ot_c2_l2'), o None si no existe
+    """
+    dataset_config = load_config().get('datasets', {}).get(dataset_key)
+    if not dataset_config:
+        return None
+    return dataset_config.get('m2m_name')
+
+# =====================================================
+# JSON
+# =====================================================
+
+def json_dumps(obj) -> bytes:
+    """
+    Serializa un objeto a JSON (bytes UTF-8), usando orjson si está instalado
+    
+    Args:
+        obj: Objeto serializable
+    
+    Returns:
+        bytes: Documento JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
+
+
+def json_loads(data):
+    """
+    Deserializa un documento JSON (str o bytes), usando orjson si está instalado
+    
+    Args:
+        data: Documento JSON
+    
+    Returns:
+        Objeto Python deserializado
+    
+    Raises:
+        ValueError: Si el documento no es JSON válido
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 # =====================================================
 # LOGGING
 # =====================================================
 
+# Listeners activos por nombre de logger: escriben a archivo/consola en un hilo aparte
+_LOG_LISTENERS: Dict[str, logging.handlers.QueueListener] = {}
+
+
+def _stop_log_listener(name: str):
+    """Detiene el listener de un logger (vaciando su cola) y cierra sus handlers"""
+    listener = _LOG_LISTENERS.pop(name, None)
+    if listener is None:
+        return
+    
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+
+@atexit.register
+def _stop_all_log_listeners():
+    """Vacía las colas de logging pendientes al terminar el proceso"""
+    for name in list(_LOG_LISTENERS):
+        _stop_log_listener(name)
+
+
 def setup_logger(
     name: str,
     log_file: Optional[str] = None,
@@ -101,6 +279,9 @@ def setup_logger(
     """
     Configura un logger profesional.
     El nivel de log se toma del argumento, o de la config, o por defecto 'INFO'.
+    
+    Los registros se encolan (QueueHandler) y un QueueListener los escribe en archivo/consola,
+    así los hilos de descarga no esperan por la escritura del log.
     """
     config = load_config().get('PROCESSING_CONFIG', {})
     log_level = level or config.get('LOG_LEVEL', 'INFO')
@@ -108,22 +289,32 @@ def setup_logger(
     logger = logging.getLogger(name)
     logger.setLevel(getattr(logging, log_level.upper()))
     logger.handlers.clear()
+    _stop_log_listener(name)
     
     formatter = logging.Formatter(
         '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S'
     )
     
+    handlers = []
+    
     if log_file:
         log_dir = get_data_dirs()['logs']
         file_handler = logging.FileHandler(log_dir / log_file, encoding='utf-8')
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
     
     if console:
         console_handler = logging.StreamHandler(sys.stdout)
         console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
+        handlers.append(console_handler)
+    
+    if handlers:
+        log_queue = queue.Queue(-1)
+        listener = logging.handlers.QueueListener(log_queue, *handlers)
+        listener.start()
+        _LOG_LISTENERS[name] = listener
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
     
     return logger
 
@@ -131,9 +322,12 @@ def setup_logger(
 # GEOJSON Y GEOMETRÍA
 # =====================================================
 
+@lru_cache(maxsize=8)
 def load_aoi_geojson(geojson_path: Optional[str] = None) -> Dict:
     """
     Carga el GeoJSON del AOI desde la ruta definida en la configuración.
+    
+    El resultado se cachea por ruta: no modificar el diccionario retornado.
     """
     if geojson_path is None:
         config = load_config().get('aoi', {}) # Changed from 'AREA_OF_INTEREST' to 'aoi'
@@ -148,8 +342,8 @@ def load_aoi_geojson(geojson_path: Optional[str] = None) -> Dict:
     if not full_path.exists():
         raise FileNotFoundError(f"GeoJSON file not found: {full_path}")
     
-    with open(full_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    with open(full_path, 'rb') as f:
+        return json_loads(f.read())
 
 # ... (El resto de funciones de geojson y db helpers se mantienen igual, ya que leen del .env que ahora solo tiene secretos)
 # ...
@@ -195,9 +389,9 @@ def get_bbox_from_geojson(geojson: Dict) -> Tuple[float, float, float, float]:
     else:
         coords = geojson['coordinates'][0]
     
-    # Calcular bbox
-    lons = [c[0] for c in coords]
-    lats = [c[1] for c in coords]
+    # Calcular bbox (zip transpone el anillo en C; se ignora una posible coordenada Z)
+    columns = tuple(zip(*coords))
+    lons, lats = columns[0], columns[1]
     
     return (min(lons), min(lats), max(lons), max(lats))
 
@@ -302,6 +496,9 @@ def get_jdbc_properties(env: Optional[Dict] = None) -> Dict[str, str]:
 # ... (El resto de helpers se mantiene sin cambios)
 
 
+_SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB', 'PB')
+
+
 def format_file_size(size_bytes: float) -> str:
     """
     Formatea un tamaño de archivo en bytes a formato legible
@@ -312,13 +509,30 @@ def format_file_size(size_bytes: float) -> str:
     Returns:
         str: Tamaño formateado (ej: "123.45 MB")
     """
-    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-        if size_bytes < 1024.0:
-            return f"{size_bytes:.2f} {unit}"
-        size_bytes /= 1024.0
-    return f"{size_bytes:.2f} PB"
-
-
+    if size_bytes < 1024.0:
+        return f"{size_bytes:.2f} B"
+    
+    # Cada unidad son 10 bits: el índice sale directo de la longitud en bits
+    index = min((int(size_bytes).bit_length() - 1) // 10, len(_SIZE_UNITS) - 1)
+    return f"{size_bytes / (1 << (10 * index)):.2f} {_SIZE_UNITS[index]}"
+
+
+# Prefijo de misión (Collection 2 'LC08' o ID de escena antiguo 'LC8') -> sensor
+_SENSOR_MAP = {
+    'LC08': 'OLI',
+    'LC09': 'OLI',
+    'LC8': 'OLI',
+    'LC9': 'OLI',
+    'LE07': 'ETM+',
+    'LE7': 'ETM+',
+    'LT05': 'TM',
+    'LT04': 'TM',
+    'LT5': 'TM',
+    'LT4': 'TM',
+}
+
+
+@lru_cache(maxsize=4096)
 def get_sensor_from_entity_id(entity_id: str) -> str:
     """
     Extrae el sensor desde un entity_id de Landsat
@@ -342,20 +556,7 @@ def get_sensor_from_entity_id(entity_id: str) -> str:
     else:
         satellite = entity_id[:3]
     
-    sensor_map = {
-        'LC08': 'OLI',
-        'LC09': 'OLI',
-        'LC8': 'OLI',
-        'LC9': 'OLI',
-        'LE07': 'ETM+',
-        'LE7': 'ETM+',
-        'LT05': 'TM',
-        'LT04': 'TM',
-        'LT5': 'TM',
-        'LT4': 'TM',
-    }
-    
-    return sensor_map.get(satellite, 'UNKNOWN')
+    return _SENSOR_MAP.get(satellite, 'UNKNOWN')
 
 
 # =====================================================
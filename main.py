@@ -4,25 +4,76 @@ Entry Point Principal - GIS Engine
 Uso: python main.py [comando] [opciones]
 """
 import argparse
+import re
 import sys
 from datetime import datetime
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+# Los módulos pesados del paquete ETL (requests, psycopg2...) se importan dentro de cada
+# manejador, así --help y los errores de argumentos no pagan su carga
+
+# Máximo de borrados de listas M2M simultáneos en cleanup-lists
+_CLEANUP_WORKERS = 8
+
+# Formato estricto de fechas del CLI (fromisoformat también acepta otras variantes ISO)
+_DATE_RE = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+
+def _parse_date(value):
+    """
+    Parsea una fecha YYYY-MM-DD del CLI
+    
+    Args:
+        value: Fecha en texto
+    
+    Returns:
+        datetime: Fecha parseada
+    
+    Raises:
+        ValueError: Si la fecha no tiene formato YYYY-MM-DD o no es válida
+    """
+    if not _DATE_RE.fullmatch(value):
+        raise ValueError(f"'{value}' no tiene el formato YYYY-MM-DD")
+    return datetime.fromisoformat(value)
+
+
+@lru_cache(maxsize=1)
+def _cached_config():
+    """
+    Carga la configuración una sola vez por proceso, recordando también su ausencia
+    
+    Returns:
+        Dict: Configuración, o None si no existe config/landsat_config.yaml
+    """
+    from etl.utils import load_config
+    
+    try:
+        return load_config()
+    except FileNotFoundError:
+        return None
 
-# Importar los módulos necesarios del paquete ETL
-from etl.bronze_ingestion import BronzeIngestion
-from etl.m2m_client import M2MClient
-from etl.utils import setup_logger, load_config
 
 def handle_ingest(args):
     """
     Manejador para el comando 'ingest'.
     """
+    from etl.bronze_ingestion import BronzeIngestion
+    from etl.utils import setup_logger, get_m2m_name
+    
     # ... (contenido existente de handle_ingest) ...
-    config = load_config()
+    config = _cached_config()
+    if config is None:
+        print("Error: No se encontró el archivo de configuración 'config/landsat_config.yaml'.")
+        sys.exit(1)
+    
+    # Marca de tiempo de la ejecución (nombre del archivo de log)
+    now_tag = datetime.now().strftime('%Y%m%d_%H%M%S')
     
     # Validar fechas
     try:
-        start_date = datetime.strptime(args.start, '%Y-%m-%d')
-        end_date = datetime.strptime(args.end, '%Y-%m-%d')
+        start_date = _parse_date(args.start)
+        end_date = _parse_date(args.end)
         if start_date > end_date:
             print(f"Error: La fecha de inicio ({args.start}) es posterior al fin ({args.end})")
             sys.exit(1)
@@ -32,14 +83,16 @@ def handle_ingest(args):
 
     # Configurar logging
     log_level = args.log_level or config.get('logging', {}).get('level', 'INFO')
+    # En dry-run solo se loguea a consola: no se crea archivo de log
+    log_file = None if args.dry_run else f'ingest_{now_tag}.log'
     logger = setup_logger(
         'BronzeETL',
-        log_file=f'ingest_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log',
+        log_file=log_file,
         level=log_level
     )
     
     logger.info("--- INICIO PROCESO DE INGESTA ---")
-    logger.info(f"Periodo: {args.start} - {args.end}")
+    logger.info("Periodo: %s - %s", args.start, args.end)
     
     if args.dry_run:
         logger.warning("MODO DRY-RUN ACTIVADO: Simulación de ejecución. No se descargarán ni insertarán datos.")
@@ -51,14 +104,13 @@ def handle_ingest(args):
         # Obtener los m2m_name de los datasets seleccionados desde la config
         selected_datasets = None
         if args.datasets:
-            all_datasets_config = config.get('datasets', {})
-            selected_datasets = [
-                all_datasets_config.get(ds, {}).get('m2m_name')
-                for ds in args.datasets
-            ]
-            if not all(selected_datasets):
-                logger.error("Uno o más datasets seleccionados no se encontraron en la configuración.")
-                sys.exit(1)
+            selected_datasets = []
+            for ds in args.datasets:
+                m2m_name = get_m2m_name(ds)
+                if not m2m_name:
+                    logger.error("El dataset '%s' no se encontró en la configuración o no define m2m_name.", ds)
+                    sys.exit(1)
+                selected_datasets.append(m2m_name)
         
         ingestion = BronzeIngestion(
             start_date=args.start,
@@ -71,15 +123,15 @@ def handle_ingest(args):
         stats = ingestion.run(datasets=selected_datasets)
         
         logger.info("--- RESUMEN DE INGESTA ---")
-        logger.info(f"Escenas encontradas: {stats['total_scenes']}")
-        logger.info(f"Procesadas OK:       {stats['successful_scenes']}")
-        logger.info(f"Fallidas:            {stats['failed_scenes']}")
+        logger.info("Escenas encontradas: %s", stats['total_scenes'])
+        logger.info("Procesadas OK:       %s", stats['successful_scenes'])
+        logger.info("Fallidas:            %s", stats['failed_scenes'])
         
         if stats['failed_scenes'] > 0:
             sys.exit(1)
             
     except Exception as e:
-        logger.error(f"Error fatal en ingesta: {e}", exc_info=True)
+        logger.error("Error fatal en ingesta: %s", e, exc_info=True)
         sys.exit(1)
 
 def handle_cleanup(args):
@@ -87,6 +139,9 @@ def handle_cleanup(args):
     Manejador para el comando 'cleanup-lists'.
     Limpia listas de escenas específicas en M2M API.
     """
+    from etl.m2m_client import M2MClient
+    from etl.utils import setup_logger
+    
     logger = setup_logger('CleanupLists', level='INFO')
     
     if args.dry_run:
@@ -98,43 +153,98 @@ def handle_cleanup(args):
         logger.info("No se especificaron listas para borrar.")
         return
 
-    print(f"\nSe han seleccionado {len(lists_to_delete)} listas para borrar:")
-    for lid in lists_to_delete:
-        print(f"  - {lid}")
+    # Un solo write para la cabecera y todas las listas
+    sys.stdout.write(
+        f"\nSe han seleccionado {len(lists_to_delete)} listas para borrar:\n"
+        + ''.join(f"  - {lid}\n" for lid in lists_to_delete)
+    )
     
     if args.dry_run:
         print("\n[DRY-RUN] Se borrarían estas listas.")
         return
 
     if not args.force:
+        # Sin terminal (CI, tuberías) no se puede confirmar: se exige --force
+        if not sys.stdin.isatty():
+            print("Error: entrada no interactiva, use --force para borrar sin confirmación. Operación cancelada.", file=sys.stderr)
+            sys.exit(1)
         confirm = input(f"\n¿Está seguro de que desea borrar estas {len(lists_to_delete)} listas? (y/n): ")
         if confirm.lower() != 'y':
             print("Operación cancelada.")
             return
     
     try:
+        # Los borrados son independientes: se envían en paralelo sobre la sesión compartida
+        workers = min(_CLEANUP_WORKERS, len(lists_to_delete))
         with M2MClient(logger=logger, dry_run=args.dry_run) as client:
             print("\nIniciando borrado...")
-            deleted_count = 0
-            for lid in lists_to_delete:
-                if client.delete_list(lid):
-                    deleted_count += 1
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                deleted_count = sum(executor.map(client.delete_list, lists_to_delete))
             
-            logger.info(f"Limpieza completada. Listas borradas: {deleted_count}/{len(lists_to_delete)}")
+            logger.info("Limpieza completada. Listas borradas: %s/%s", deleted_count, len(lists_to_delete))
 
     except Exception as e:
-        logger.error(f"Error durante la limpieza: {e}")
+        logger.error("Error durante la limpieza: %s", e)
         sys.exit(1)
 
-def main():
+_SUBCOMMANDS = ('ingest', 'cleanup-lists')
+
+
+@lru_cache(maxsize=1)
+def _available_datasets():
+    """
+    Obtiene los datasets definidos en la configuración para validar --datasets
+    
+    Returns:
+        List[str]: Nombres de los datasets disponibles
+    """
     # Cargar config para obtener la lista de datasets para el CLI
-    try:
-        config = load_config()
-        available_datasets = list(config.get('datasets', {}).keys())
-    except FileNotFoundError:
+    config = _cached_config()
+    if config is None:
         print("Error: No se encontró el archivo de configuración 'config/landsat_config.yaml'.")
         # Usar una lista por defecto si no se puede cargar la configuración
-        available_datasets = ['landsat_8_9', 'landsat_7', 'landsat_4_5']
+        return ['landsat_8_9', 'landsat_7', 'landsat_4_5']
+    
+    return list(config.get('datasets', {}).keys())
+
+
+def _dataset_choice(name):
+    """
+    Tipo argparse para --datasets: valida el nombre contra la configuración
+    
+    La configuración solo se lee si se usa --datasets, no al construir el parser.
+    
+    Args:
+        name: Nombre del dataset indicado en la línea de comandos
+    
+    Returns:
+        str: El mismo nombre, si es válido
+    
+    Raises:
+        argparse.ArgumentTypeError: Si el dataset no existe en la configuración
+    """
+    available_datasets = _available_datasets()
+    if name not in available_datasets:
+        choices = ', '.join(repr(ds) for ds in available_datasets)
+        raise argparse.ArgumentTypeError(f"invalid choice: {name!r} (choose from {choices})")
+    return name
+
+
+def _sniff_subcommand(argv):
+    """
+    Detecta el subcomando invocado sin parsear los argumentos completos
+    
+    Args:
+        argv: Argumentos de línea de comandos (sys.argv)
+    
+    Returns:
+        str: Nombre del subcomando, o None si no se indicó ninguno (p. ej. --help)
+    """
+    return next((arg for arg in argv[1:] if arg in _SUBCOMMANDS), None)
+
+
+def main():
+    command = _sniff_subcommand(sys.argv)
 
     parser = argparse.ArgumentParser(
         description="GIS Engine - CLI de Gestión de Datos Landsat",
@@ -144,22 +254,25 @@ def main():
     subparsers = parser.add_subparsers(dest='command', help='Comandos disponibles')
     subparsers.required = True
     
-    # --- Subcomando: ingest ---
-    parser_ingest = subparsers.add_parser('ingest', help='Ingesta de datos Landsat (Capa Bronze)')
-    parser_ingest.add_argument('--start', required=True, help='Fecha inicio (YYYY-MM-DD)')
-    parser_ingest.add_argument('--end', required=True, help='Fecha fin (YYYY-MM-DD)')
-    parser_ingest.add_argument('--clouds', type=int, help='Max cobertura de nubes %% (default: config)')
-    parser_ingest.add_argument('--datasets', nargs='+', choices=available_datasets, help='Datasets específicos (default: todos)')
-    parser_ingest.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING'], help='Nivel de log (default: config)')
-    parser_ingest.add_argument('--dry-run', action='store_true', help='Ejecutar sin descargar/insertar')
-    parser_ingest.set_defaults(func=handle_ingest)
-    
-    # --- Subcomando: cleanup-lists ---
-    parser_cleanup = subparsers.add_parser('cleanup-lists', help='Limpiar listas de escenas específicas en M2M')
-    parser_cleanup.add_argument('--list-id', required=True, nargs='+', help='ID(s) de las listas a borrar')
-    parser_cleanup.add_argument('--dry-run', action='store_true', help='Simular borrado sin ejecutarlo')
-    parser_cleanup.add_argument('--force', action='store_true', help='Borrar sin pedir confirmación')
-    parser_cleanup.set_defaults(func=handle_cleanup)
+    # Solo se construye el subcomando invocado (ambos si no se indicó ninguno)
+    if command in (None, 'ingest'):
+        # --- Subcomando: ingest ---
+        parser_ingest = subparsers.add_parser('ingest', help='Ingesta de datos Landsat (Capa Bronze)')
+        parser_ingest.add_argument('--start', required=True, help='Fecha inicio (YYYY-MM-DD)')
+        parser_ingest.add_argument('--end', required=True, help='Fecha fin (YYYY-MM-DD)')
+        parser_ingest.add_argument('--clouds', type=int, help='Max cobertura de nubes %% (default: config)')
+        parser_ingest.add_argument('--datasets', nargs='+', type=_dataset_choice, help='Datasets específicos de la config (default: todos)')
+        parser_ingest.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING'], help='Nivel de log (default: config)')
+        parser_ingest.add_argument('--dry-run', action='store_true', help='Ejecutar sin descargar/insertar')
+        parser_ingest.set_defaults(func=handle_ingest)
+    
+    if command in (None, 'cleanup-lists'):
+        # --- Subcomando: cleanup-lists ---
+        parser_cleanup = subparsers.add_parser('cleanup-lists', help='Limpiar listas de escenas específicas en M2M')
+        parser_cleanup.add_argument('--list-id', required=True, nargs='+', help='ID(s) de las listas a borrar')
+        parser_cleanup.add_argument('--dry-run', action='store_true', help='Simular borrado sin ejecutarlo')
+        parser_cleanup.add_argument('--force', action='store_true', help='Borrar sin pedir confirmación')
+        parser_cleanup.set_defaults(func=handle_cleanup)
     
     if len(sys.argv) == 1:
         parser.print_help(sys.stderr)
@@ -2,6 +2,7 @@ import sys
 from pathlib import Path
 from datetime import datetime, timedelta
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 # Add project root to sys.path to allow imports from etl
 project_root = Path(__file__).resolve().parent.parent
@@ -13,6 +14,17 @@ from etl.utils import setup_logger, load_aoi_geojson, geojson_to_m2m_spatial_fil
 # Setup a dedicated logger for this script
 logger = setup_logger('M2MDebugClient', level='DEBUG')
 
+def _cloud_cover_sort_key(scene):
+    """Sort key for scenes by cloud cover; missing or unknown (M2M reports -1) values sort last."""
+    cloud_cover = scene.get('cloudCover')
+    if cloud_cover is None:
+        return 100.0
+    try:
+        cloud_cover = float(cloud_cover)
+    except (TypeError, ValueError):
+        return 100.0
+    return cloud_cover if cloud_cover >= 0 else 100.0
+
 def debug_m2m_download_options():
     logger.info("Starting M2M download options debug script...")
     env = load_env()
@@ -25,50 +37,53 @@ def debug_m2m_download_options():
             spatial_filter = geojson_to_m2m_spatial_filter(aoi_geojson)
 
             # Look for scenes in the last 60 days
-            end_date = datetime.now()
+            now = datetime.now()
+            now_tag = now.strftime('%Y%m%d_%H%M%S')
+            end_date = now
             start_date = end_date - timedelta(days=60)
             temporal_filter = {
                 'start': start_date.strftime('%Y-%m-%d'),
                 'end': end_date.strftime('%Y-%m-%d')
             }
-            cloud_filter = {'min': 0, 'max': 10} # Very low cloud cover
+            # Single search with the wider cloud range; the clearest scene is picked client-side
+            cloud_filter = {'min': 0, 'max': 50}
 
             scenes = client.search_scenes(
                 dataset_name='landsat_ot_c2_l2', # Landsat 8-9
                 spatial_filter=spatial_filter,
                 temporal_filter=temporal_filter,
                 cloud_cover_filter=cloud_filter,
-                max_results=1
+                max_results=10
             )
 
             if not scenes:
-                logger.warning("No suitable scenes found with current filters. Trying a wider cloud cover range.")
-                cloud_filter = {'min': 0, 'max': 50}
-                scenes = client.search_scenes(
-                    dataset_name='landsat_ot_c2_l2', # Landsat 8-9
-                    spatial_filter=spatial_filter,
-                    temporal_filter=temporal_filter,
-                    cloud_cover_filter=cloud_filter,
-                    max_results=1
-                )
-                if not scenes:
-                    logger.error("Still no scenes found. Cannot proceed with download options test.")
-                    return
+                logger.error("No scenes found. Cannot proceed with download options test.")
+                return
+
+            scenes.sort(key=_cloud_cover_sort_key)
 
             entity_id = scenes[0]['entityId']
-            logger.info(f"Found scene: {entity_id}")
+            logger.info(f"Found scene: {entity_id} (cloud cover: {scenes[0].get('cloudCover')})")
 
             # 2. Add scene to a temporary list
-            list_id = f"debug_list_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            list_id = f"debug_list_{now_tag}"
             logger.info(f"Adding scene {entity_id} to temporary list: {list_id}")
             client.add_scenes_to_list(list_id, [entity_id], 'landsat_ot_c2_l2')
 
             # 3. Attempt to get download options for the list
             file_types_to_test = ['band', 'bundle', 'band_group']
             
-            for file_type_to_test in file_types_to_test:
-                logger.info(f"Attempting to get download options for list {list_id} with fileType='{file_type_to_test}'...")
-                products = client.get_download_options(list_id, 'landsat_ot_c2_l2', file_type=file_type_to_test)
+            # The three requests are independent: issue them concurrently on the shared session
+            with ThreadPoolExecutor(max_workers=len(file_types_to_test)) as executor:
+                futures = {}
+                for file_type_to_test in file_types_to_test:
+                    logger.info(f"Attempting to get download options for list {list_id} with fileType='{file_type_to_test}'...")
+                    futures[file_type_to_test] = executor.submit(
+                        client.get_download_options, list_id, 'landsat_ot_c2_l2', file_type=file_type_to_test
+                    )
+
+            for file_type_to_test, future in futures.items():
+                products = future.result()
 
                 logger.info(f"Successfully retrieved {len(products)} products/download options for fileType='{file_type_to_test}'.")
                 if products: